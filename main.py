@@ -1,11 +1,27 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from routes.chat_router import router as chat_router
 from routes.analyse_router import router as analyse_router
 from routes.admin_router import router as admin_router
+from services.indexes import ensure_indexes
+from services.diagram_snapshots import run_diagram_refresher
+from services.repository import backfill_chat_created_at, db_manager
+from services import llm_gateway
+from services.stream_buffers import STREAM_ID_HEADER
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes(db_manager.db)
+    await backfill_chat_created_at()
+    diagram_refresher = asyncio.create_task(run_diagram_refresher())
+    yield
+    diagram_refresher.cancel()
+    await llm_gateway.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -13,6 +29,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[STREAM_ID_HEADER],
 )
 
 app.include_router(chat_router)
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 from typing import List, Optional
 
 class ConfigModel(BaseModel):
@@ -16,6 +16,12 @@ class AnalyzePayload(BaseModel):
     session_id: str
     prolific_id: str
 
+class BatchAnalyzePayload(BaseModel):
+    session_ids: Optional[List[str]] = None
+    completed_only: bool = True
+    concurrency: Optional[int] = None
+    max_retries: Optional[int] = None
+
 class ChatRequest(BaseModel):
     message: str
 
@@ -23,3 +29,35 @@ class FinalIdeaRequest(BaseModel):
     idea: str
     prolific_id: str
 
+
+class AnalysisDetails(BaseModel):
+    role_analysis: str
+    influence: str
+    original_elements: str
+    overall_assessment: str
+
+class AnalysisResult(BaseModel):
+    """
+    Structured output of the final-idea evaluation (see get_analysis_prompt).
+    """
+    originality_score: float
+    matching_score: float
+    assistant_influence_score: float
+    analysis_details: AnalysisDetails
+
+    @field_validator("originality_score", "matching_score", "assistant_influence_score")
+    @classmethod
+    def score_in_range(cls, value: float) -> float:
+        if not 0 <= value <= 100:
+            raise ValueError("scores must be between 0 and 100")
+        return value
+
+class ThemeFrequency(BaseModel):
+    theme: str
+    frequency: float
+
+class ThemeDistribution(BaseModel):
+    """
+    Structured output of the keyword extraction (see get_keyword_extraction_prompt).
+    """
+    themes: List[ThemeFrequency]
@@ -1,18 +1,20 @@
 from fastapi import APIRouter, HTTPException
-from services.admin_services import get_config, get_chats, get_analysis, get_all, update_config, fetch_users_by_session_id, fetch_all_users, get_statistics, delete_analysis_entry, get_analysis_data, get_diagram_data
-from datetime import datetime
-from typing import List, Dict, Optional, Any
+from services.admin_services import get_config, update_config, fetch_users_by_session_id, list_sessions, get_session_messages, get_statistics, delete_analysis_entry, get_analysis_data, get_analysis_timeseries
+from services.diagram_snapshots import get_diagram_snapshot
+from services.export_service import export_chats, export_analysis, export_all
+from datetime import datetime, timedelta
+from typing import Optional
 from models.models import ConfigModel, DownloadRequest
 
 router = APIRouter()
 
 @router.get("/stats")
-def fetch_stats():
-    return get_statistics()
+async def fetch_stats():
+    return await get_statistics()
 
 @router.get("/diagrams")
-def fetch_diagram_data():
-    return get_diagram_data()
+async def fetch_diagram_data():
+    return await get_diagram_snapshot()
 
 @router.get("/analysis")
 async def fetch_analysis(start_date: str = None, end_date: str = None):
@@ -21,33 +23,76 @@ async def fetch_analysis(start_date: str = None, end_date: str = None):
     """
     start_dt = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
     end_dt = datetime.strptime(end_date, "%Y-%m-%d") if end_date else None
-    return get_analysis_data(start_dt, end_dt)
+    return await get_analysis_data(start_dt, end_dt)
+
+@router.get("/analysis/timeseries")
+async def fetch_analysis_timeseries(granularity: str = "day", start_date: str = None, end_date: str = None, tz: str = "UTC"):
+    """
+    Counts and average scores of analyses per hour, day or week, for trend charts.
+    `end_date` is inclusive: the whole end day is counted.
+    """
+    try:
+        start_dt = datetime.strptime(start_date, "%Y-%m-%d") if start_date else None
+        end_dt = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1) if end_date else None
+        return await get_analysis_timeseries(granularity, start_dt, end_dt, tz)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @router.delete("/analysis/{session_id}")
 async def remove_analysis(session_id: str):
     """
     Delete a specific analysis entry.
     """
-    return delete_analysis_entry(session_id)
+    return await delete_analysis_entry(session_id)
 
-@router.get("/datas", response_model=List[Dict])
-async def get_users():
+@router.get("/datas")
+async def get_users(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    order: str = "desc",
+    status: Optional[str] = None,
+    prolific_id: Optional[str] = None,
+):
     """
-    Récupère toutes les données depuis MongoDB sans filtrage.
+    Liste paginée (keyset sur created_at/session_id) des sessions, sans le contenu des messages.
+    Passer `next_cursor` de la réponse dans `cursor` pour obtenir la page suivante.
     """
-    return await fetch_all_users()
+    try:
+        return await list_sessions(limit, cursor, order, status, prolific_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/user", response_model=List[Dict[str, Any]])
-async def get_users(id_session: Optional[str] = None):
+@router.get("/user")
+async def get_user(
+    id_session: Optional[str] = None,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    order: str = "desc",
+    status: Optional[str] = None,
+    prolific_id: Optional[str] = None,
+):
     """
-    Récupère toutes les données depuis MongoDB.
-    - Si `id_session` est fourni, retourne les données filtrées par session_id.
-    - Sinon, retourne toutes les sessions.
+    Récupère les données depuis MongoDB.
+    - Si `id_session` est fourni, retourne le détail complet de cette session.
+    - Sinon, retourne une page de résumés de sessions (voir /datas).
     """
     if id_session:
         result = await fetch_users_by_session_id(id_session)
         return [result] if result else [] 
-    return await fetch_all_users()
+    try:
+        return await list_sessions(limit, cursor, order, status, prolific_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/sessions/{session_id}/messages")
+async def get_messages(session_id: str, offset: int = 0, limit: int = 50):
+    """
+    Charge à la demande les messages d'une session.
+    """
+    result = await get_session_messages(session_id, offset, limit)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return result
 
 @router.get("/config", response_model=ConfigModel)
 async def get_configuration():
@@ -69,24 +114,35 @@ async def update_configuration(config_data: ConfigModel):
         raise HTTPException(status_code=400, detail="Failed to update configuration")
     return updated_config
 
-@router.post("/download/chats", response_model=List[dict])
+@router.post("/download/chats")
 async def download_chats(request: DownloadRequest):
-    chats = await get_chats(request.ids)
-    if not chats:
+    """
+    Stream the requested chats as JSON (default), NDJSON or CSV depending on `format`.
+    """
+    try:
+        response = await export_chats(request.ids, request.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if response is None:
         raise HTTPException(status_code=400, detail="No chats found for given IDs")
-    return chats
+    return response
 
-@router.post("/download/analysis", response_model=List[dict])
+@router.post("/download/analysis")
 async def download_analysis(request: DownloadRequest):
-    analyses = await get_analysis(request.ids, request.format)
-    if not analyses:
+    try:
+        response = await export_analysis(request.ids, request.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if response is None:
         raise HTTPException(status_code=400, detail="No analyses found for given IDs")
-    return analyses
+    return response
 
-@router.post("/download/all", response_model=dict)
+@router.post("/download/all")
 async def download_all(request: DownloadRequest):
-    data = await get_all(request.ids, request.format)
-    if not data["chats"] and not data["analyses"]:
+    try:
+        response = await export_all(request.ids, request.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if response is None:
         raise HTTPException(status_code=400, detail="No data found for given IDs")
-    return data
-
+    return response
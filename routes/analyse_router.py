@@ -1,49 +1,43 @@
 from fastapi import APIRouter, HTTPException
-from datetime import datetime
-from services.analysis_service import compute_time_stats, compute_size_stats, analyze_final_idea
-from services.mongodb_connection import MongoDBManager
-from models.models import AnalyzePayload
+from services import repository
+from services.analysis_jobs import enqueue_analysis, get_job
+from services.analysis_batches import start_batch, get_batch
+from models.models import AnalyzePayload, BatchAnalyzePayload
 
 router = APIRouter()
-mongo_manager = MongoDBManager()
-db = mongo_manager.db
 
-@router.post("/analyze")
+@router.post("/analyze", status_code=202)
 async def analyze_session(payload: AnalyzePayload):
-    session_id = payload.session_id
-    prolific_id = payload.prolific_id 
-
-    session_doc = db["chats"].find_one({"session_id": session_id})
+    """
+    Queue the analysis of a session and return its job id right away.
+    Poll GET /analyze/jobs/{job_id} for the status and result.
+    """
+    session_doc = await repository.find_chat(payload.session_id, {"_id": 1})
     if not session_doc:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    conversation_history = session_doc.get("conversation_history", [])
-    final_idea = session_doc.get("final_idea", "")
-
-    time_stats = compute_time_stats(conversation_history)
-    size_stats = compute_size_stats(conversation_history)
-
-    try:
-        originality_score, matching_score, matching_analysis, assistant_influence_score = analyze_final_idea(conversation_history, final_idea)
-    except ValueError:
-        return False  
-
-    analysis_result = {
-        "session_id": session_id,
-        "prolific_id": prolific_id,
-        "final_idea": final_idea,
-        "time_stats": time_stats,
-        "size_stats": size_stats,
-        "originality_score": originality_score,
-        "matching_score": matching_score,
-        "assistant_influence_score": assistant_influence_score,
-        "matching_analysis": matching_analysis,
-        "created_at": datetime.utcnow().isoformat(),
-    }
-
-    try:
-        inserted_doc = db["analyses"].insert_one(analysis_result)
-        return inserted_doc.acknowledged  
-    except Exception as e:
-        return False 
-    
+    job = await enqueue_analysis(payload.session_id, payload.prolific_id)
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+@router.get("/analyze/jobs/{job_id}")
+async def analysis_job_status(job_id: str):
+    job = await get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.post("/analyze/batch", status_code=202)
+async def analyze_batch(payload: BatchAnalyzePayload):
+    """
+    Re-analyze many sessions in the background (all completed sessions if no ids are given).
+    Poll GET /analyze/batch/{batch_id} for progress.
+    """
+    batch = await start_batch(payload.session_ids, payload.completed_only, payload.concurrency, payload.max_retries)
+    return {"batch_id": batch["batch_id"], "status": batch["status"], "total": batch["total"]}
+
+@router.get("/analyze/batch/{batch_id}")
+async def analysis_batch_status(batch_id: str):
+    batch = await get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch
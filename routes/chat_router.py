@@ -1,5 +1,6 @@
+from typing import Optional
 from fastapi import APIRouter, Header, Depends, HTTPException, Query
-from services.chat_handler import process_chat_stream
+from services.chat_handler import process_chat_stream, resume_chat_stream
 from services.getConversation_service import get_conversation
 from services.saveConversation_service import update_final_idea 
 from models.models import ChatRequest, FinalIdeaRequest
@@ -9,10 +10,40 @@ router = APIRouter()
 async def get_session_id(x_session_id: str = Header(...)):
     return x_session_id
 
+async def wants_sse(accept: Optional[str] = Header(None)):
+    # Mode SSE si le client accepte text/event-stream (EventSource, fetch), sinon texte brut.
+    return "text/event-stream" in (accept or "")
+
 @router.post("/chat_stream")
-async def chat_stream_endpoint(request: ChatRequest, session_id: str = Depends(get_session_id)):
+async def chat_stream_endpoint(
+    request: ChatRequest,
+    session_id: str = Depends(get_session_id),
+    sse: bool = Depends(wants_sse),
+    x_client_message_id: Optional[str] = Header(None),
+):
+    """
+    `X-Client-Message-Id` (optionnel) : identifiant du message côté client, renvoyé tel quel
+    si le message est ré-envoyé après une coupure, pour reprendre la même réponse.
+    """
     conversation_history = []  
-    return await process_chat_stream(request.message, session_id, conversation_history)
+    return await process_chat_stream(request.message, session_id, conversation_history, sse, x_client_message_id)
+
+@router.get("/chat_stream/{stream_id}")
+async def resume_chat_stream_endpoint(
+    stream_id: str,
+    offset: int = Query(0, ge=0),
+    session_id: str = Depends(get_session_id),
+    sse: bool = Depends(wants_sse),
+    last_event_id: Optional[str] = Header(None),
+):
+    """
+    Reprend une réponse interrompue : `offset` = nombre de caractères déjà reçus
+    (en SSE, l'en-tête Last-Event-ID a priorité). L'identifiant du stream est
+    renvoyé dans l'en-tête X-Stream-Id de /chat_stream.
+    """
+    if last_event_id and last_event_id.isdigit():
+        offset = int(last_event_id)
+    return await resume_chat_stream(stream_id, session_id, offset, sse)
 
 @router.get("/conversation")
 async def conversation_endpoint(session_id: str):
@@ -27,7 +58,7 @@ async def add_final_idea_endpoint(final_idea: FinalIdeaRequest, session_id: str
     Endpoint qui enregistre l'idée finale associée à une session.
     Le session_id est transmis en query string.
     """
-    result, url = await update_final_idea(session_id, final_idea.idea, final_idea.prolific_id)
-    if result.modified_count == 0 and result.upserted_id is None:
+    changed, url = await update_final_idea(session_id, final_idea.idea, final_idea.prolific_id)
+    if not changed:
         raise HTTPException(status_code=400, detail="Erreur lors de l'ajout de l'idée finale")
     return url
@@ -0,0 +1,43 @@
+"""
+Apply the declared indexes and/or check that every query shape of the
+application is served by an index.
+
+    python -m scripts.check_indexes            # explain() each query shape, flag COLLSCANs
+    python -m scripts.check_indexes --apply    # create missing indexes first
+"""
+import sys
+import asyncio
+import argparse
+from bson import json_util
+from services.mongodb_connection import AsyncMongoDBManager
+from services.indexes import QUERY_SHAPES, ensure_indexes, find_collscans
+
+
+async def check(db) -> int:
+    collscans = 0
+    for collection_name, description, command in QUERY_SHAPES:
+        # Shapes are written in extended JSON so that dates survive the declaration.
+        command = json_util.loads(json_util.dumps(command))
+        explain = await db.command("explain", {"find": collection_name, **command}, verbosity="queryPlanner")
+        winning_plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+        flagged = find_collscans(winning_plan)
+        collscans += flagged
+        print(f"{'COLLSCAN' if flagged else 'ok':9} {collection_name:17} {description}")
+    return collscans
+
+
+async def main(apply: bool) -> int:
+    db = AsyncMongoDBManager().db
+    if apply:
+        await ensure_indexes(db)
+    collscans = await check(db)
+    if collscans:
+        print(f"\n{collscans} query shape(s) fall back to a collection scan.")
+    return 1 if collscans else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="create the declared indexes before checking")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.apply)))
@@ -0,0 +1,100 @@
+"""
+Remove duplicate documents (several for one session_id) from a collection with a
+unique session_id index, then build that index in place of the non-unique
+fallback created by ensure_indexes.
+
+Kept per session:
+  analyses       the newest analysis (created_at, then _id)
+  analysis_jobs  the most recently updated job (updated_at, then _id)
+  chats          the conversation with the most messages (then the newest _id);
+                 final_idea / prolific_id missing on it are taken from a dropped copy
+
+    python -m scripts.dedupe_sessions --collection chats [--dry-run]
+"""
+import asyncio
+import argparse
+from services.mongodb_connection import AsyncMongoDBManager
+from services.indexes import ensure_indexes, fallback_index_name
+
+UNIQUE_INDEX = "session_id_unique"
+# Fields of a dropped chat copied onto the kept one when it lacks them.
+CHAT_MERGED_FIELDS = ("final_idea", "prolific_id")
+
+# Sort stages putting the document to keep first in each session.
+KEEP_FIRST = {
+    "analyses": [{"$sort": {"created_at": -1, "_id": -1}}],
+    "analysis_jobs": [{"$sort": {"updated_at": -1, "_id": -1}}],
+    "chats": [
+        {"$addFields": {"_message_count": {"$size": {"$ifNull": ["$conversation_history", []]}}}},
+        {"$sort": {"_message_count": -1, "_id": -1}},
+    ],
+}
+
+
+async def find_duplicates(collection, collection_name: str) -> list:
+    document = {"_id": "$_id"}
+    if collection_name == "chats":
+        document.update({field: f"${field}" for field in CHAT_MERGED_FIELDS})
+    cursor = await collection.aggregate(KEEP_FIRST[collection_name] + [
+        {"$group": {"_id": "$session_id", "docs": {"$push": document}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    return await cursor.to_list(None)
+
+
+def merged_fields(docs: list) -> dict:
+    """
+    Fields missing on the kept chat (docs[0]) that a dropped copy has.
+    """
+    kept, dropped = docs[0], docs[1:]
+    values = {}
+    for field in CHAT_MERGED_FIELDS:
+        if kept.get(field) is None:
+            value = next((doc[field] for doc in dropped if doc.get(field) is not None), None)
+            if value is not None:
+                values[field] = value
+    return values
+
+
+async def main(collection_name: str, dry_run: bool) -> None:
+    db = AsyncMongoDBManager().db
+    collection = db[collection_name]
+    duplicates = await find_duplicates(collection, collection_name)
+    extra_ids = [doc["_id"] for group in duplicates for doc in group["docs"][1:]]
+    merges = []
+    if collection_name == "chats":
+        for group in duplicates:
+            values = merged_fields(group["docs"])
+            if values:
+                merges.append((group["docs"][0]["_id"], values))
+    print(
+        f"{collection_name}: {len(duplicates)} session(s) with duplicates, "
+        f"{len(extra_ids)} document(s) to delete, {len(merges)} to complete"
+    )
+    if dry_run:
+        return
+
+    for doc_id, values in merges:
+        await collection.update_one({"_id": doc_id}, {"$set": values})
+    for start in range(0, len(extra_ids), 500):
+        await collection.delete_many({"_id": {"$in": extra_ids[start:start + 500]}})
+
+    fallback = fallback_index_name(UNIQUE_INDEX)
+    if fallback in await collection.index_information():
+        await collection.drop_index(fallback)
+    await ensure_indexes(db)
+    print("Indexes:", ", ".join(sorted(await collection.index_information())))
+
+    if extra_ids and collection_name in ("analyses", "chats"):
+        # Imported here: only needed once documents counted by the rollups were removed.
+        from services import repository, stats_rollups
+        await stats_rollups.rebuild_rollups()
+        await repository.bump_revision("analyses")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collection", choices=sorted(KEEP_FIRST), default="analyses", help="collection to deduplicate")
+    parser.add_argument("--dry-run", action="store_true", help="only report the duplicates")
+    args = parser.parse_args()
+    asyncio.run(main(args.collection, args.dry_run))
@@ -0,0 +1,80 @@
+"""
+Convert legacy string timestamps to native BSON (UTC) datetimes, in batches.
+
+- chats: conversation_history[*].timestamp (America/Toronto ISO strings)
+- analyses: created_at (naive UTC isoformat strings)
+
+Safe to run while the app is serving traffic: each message is updated in place by
+its array position (histories are append-only), and documents already migrated
+are skipped, so the script can be interrupted and re-run.
+
+    python -m scripts.migrate_timestamps [--batch-size 200] [--pause 0.2] [--dry-run]
+"""
+import time
+import asyncio
+import argparse
+from pymongo import UpdateOne
+from services.mongodb_connection import AsyncMongoDBManager
+from utils.time_utils import to_utc_datetime
+
+
+def _chat_update(doc: dict):
+    changes = {}
+    for index, msg in enumerate(doc.get("conversation_history") or []):
+        if isinstance(msg.get("timestamp"), str):
+            changes[f"conversation_history.{index}.timestamp"] = to_utc_datetime(msg["timestamp"])
+    return UpdateOne({"_id": doc["_id"]}, {"$set": changes}) if changes else None
+
+
+def _analysis_update(doc: dict):
+    return UpdateOne({"_id": doc["_id"]}, {"$set": {"created_at": to_utc_datetime(doc["created_at"])}})
+
+
+async def migrate(collection, query: dict, projection: dict, build_update, batch_size: int, pause: float, dry_run: bool) -> int:
+    migrated = 0
+    started = time.monotonic()
+    last_id = None
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        docs = await collection.find(batch_query, projection).sort("_id", 1).limit(batch_size).to_list(None)
+        if not docs:
+            break
+        last_id = docs[-1]["_id"]
+        operations = [op for op in map(build_update, docs) if op is not None]
+        if operations and not dry_run:
+            await collection.bulk_write(operations, ordered=False)
+        migrated += len(operations)
+        elapsed = time.monotonic() - started
+        print(f"{collection.name}: {migrated} documents ({migrated / elapsed:.0f}/s)")
+        if pause:
+            await asyncio.sleep(pause)
+    return migrated
+
+
+async def main(batch_size: int, pause: float, dry_run: bool):
+    db = AsyncMongoDBManager().db
+    await migrate(
+        db["chats"],
+        {"conversation_history.timestamp": {"$type": "string"}},
+        {"conversation_history.timestamp": 1},
+        _chat_update,
+        batch_size, pause, dry_run,
+    )
+    await migrate(
+        db["analyses"],
+        {"created_at": {"$type": "string"}},
+        {"created_at": 1},
+        _analysis_update,
+        batch_size, pause, dry_run,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--pause", type=float, default=0.2, help="seconds to sleep between batches")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = parser.parse_args()
+    asyncio.run(main(args.batch_size, args.pause, args.dry_run))
@@ -0,0 +1,119 @@
+"""
+Recompute time_stats and size_stats of every analysis from its chat history,
+without any LLM call, using a process pool.
+
+Analyses are walked in session_id order; after each written batch the last
+session_id is saved to a checkpoint file, so an interrupted run continues
+where it stopped with --resume.
+
+    python -m scripts.recompute_stats [--workers 4] [--batch-size 500] [--chunk-size 50] [--resume]
+"""
+import os
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pymongo import UpdateOne
+from services.mongodb_connection import MongoDBManager
+from services.session_stats import compute_batch_stats
+
+DEFAULT_CHECKPOINT = ".recompute_stats.checkpoint.json"
+
+_HISTORY_PROJECTION = {
+    "_id": 0,
+    "session_id": 1,
+    "conversation_history.role": 1,
+    "conversation_history.timestamp": 1,
+    "conversation_history.size": 1,
+    "conversation_history.content": 1,
+}
+
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"last_session_id": None, "updated": 0}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def iter_session_batches(analyses, last_session_id, batch_size):
+    """
+    Session ids of analyses in ascending order, `batch_size` at a time, after `last_session_id`.
+    """
+    query = {"session_id": {"$gt": last_session_id}} if last_session_id is not None else {}
+    batch = []
+    for doc in analyses.find(query, {"_id": 0, "session_id": 1}).sort("session_id", 1).batch_size(batch_size):
+        batch.append(doc["session_id"])
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _refresh_aggregates():
+    # Imported here so that pool workers (spawned) never load the async client.
+    from services import repository, stats_rollups
+    await stats_rollups.rebuild_rollups()
+    await repository.bump_revision("analyses")
+
+
+def main(workers: int, batch_size: int, chunk_size: int, checkpoint_path: str, resume: bool) -> None:
+    db = MongoDBManager().db
+    chats, analyses = db["chats"], db["analyses"]
+    checkpoint = load_checkpoint(checkpoint_path) if resume else {"last_session_id": None, "updated": 0}
+    if resume and checkpoint["last_session_id"] is not None:
+        print(f"Resuming after session {checkpoint['last_session_id']} ({checkpoint['updated']} already updated)")
+
+    started = time.monotonic()
+    processed = 0
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        for session_ids in iter_session_batches(analyses, checkpoint["last_session_id"], batch_size):
+            histories = {
+                doc["session_id"]: doc.get("conversation_history") or []
+                for doc in chats.find({"session_id": {"$in": session_ids}}, _HISTORY_PROJECTION)
+            }
+            found = [session_id for session_id in session_ids if session_id in histories]
+            chunks = [found[i:i + chunk_size] for i in range(0, len(found), chunk_size)]
+            results = pool.map(compute_batch_stats, [[histories[s] for s in chunk] for chunk in chunks])
+
+            operations = [
+                UpdateOne({"session_id": session_id}, {"$set": {"time_stats": time_stats, "size_stats": size_stats}})
+                for chunk, chunk_results in zip(chunks, results)
+                for session_id, (time_stats, size_stats) in zip(chunk, chunk_results)
+            ]
+            if operations:
+                analyses.bulk_write(operations, ordered=False)
+
+            processed += len(session_ids)
+            checkpoint = {"last_session_id": session_ids[-1], "updated": checkpoint["updated"] + len(operations)}
+            save_checkpoint(checkpoint_path, checkpoint)
+            elapsed = time.monotonic() - started
+            print(f"{processed} sessions, {checkpoint['updated']} updated - {processed / elapsed:.0f} sessions/s")
+
+    asyncio.run(_refresh_aggregates())
+    elapsed = time.monotonic() - started
+    print(f"Done: {processed} sessions in {elapsed:.1f}s")
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=500, help="sessions fetched and written per batch")
+    parser.add_argument("--chunk-size", type=int, default=50, help="sessions per process-pool task")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--resume", action="store_true", help="continue after the session saved in the checkpoint")
+    args = parser.parse_args()
+    main(args.workers, args.batch_size, args.chunk_size, args.checkpoint, args.resume)
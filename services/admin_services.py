@@ -1,165 +1,95 @@
-from services.mongodb_connection import MongoDBManager
-from openai import AzureOpenAI
-import os
-from dotenv import load_dotenv
-from typing import List, Optional, Dict, Any
-from utils import cache_config
+import json
+import base64
+import logging
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from services import repository, stats_rollups
+from typing import Optional, Dict, Any
+from services.config_service import refresh_config_cache
 from utils.prompt_config import get_keyword_extraction_prompt
-from models.models import ConfigModel
+from models.models import ConfigModel, ThemeDistribution
+from services.structured_output import request_structured
+from utils.time_utils import to_utc_datetime
 
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-db_manager = MongoDBManager()
-
-chat_collection = db_manager.get_collection("chats")
-analysis_collection = db_manager.get_collection("analyses")
-config_collection = db_manager.get_collection("config")
-
-try:
-    client = AzureOpenAI(
-    api_key=os.getenv("API_KEY"),
-    api_version=os.getenv("OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("API_BASE")
-)
-except Exception as e:
-    raise RuntimeError(f"Erreur lors de l'initialisation du client Azure OpenAI : {e}")
-
-def get_statistics():
-    total_users = chat_collection.count_documents({})
-    total_completed_sessions = chat_collection.count_documents({"final_idea": {"$exists": True}})
+async def get_statistics():
+    """
+    Read from the incrementally maintained rollup: O(1) whatever the number of sessions.
+    """
+    rollup = await stats_rollups.get_rollup()
+    total_users = rollup.get("total_chats", 0)
+    total_completed_sessions = rollup.get("completed_sessions", 0)
     total_abandoned_sessions = total_users - total_completed_sessions
-    reengagement_pipeline = [
-        {"$match": {"time_stats.user_returned_after_30mins": True}}, 
-        {"$group": {"_id": None, "num_reengagements": {"$sum": 1}}}  
-    ]
-    reengagement_result = list(analysis_collection.aggregate(reengagement_pipeline))
-    num_reengagements = reengagement_result[0].get("num_reengagements", 0) if reengagement_result else 0
-    session_duration_pipeline = [
-        {"$match": {"time_stats.total_duration_minutes": {"$exists": True}}},
-        {"$group": {"_id": None, "avg_session_duration": {"$avg": "$time_stats.total_duration_minutes"}}}
-    ]
-    session_duration_result = list(analysis_collection.aggregate(session_duration_pipeline))
-    avg_session_duration = round(session_duration_result[0].get("avg_session_duration", 0.00), 2) if session_duration_result else 0.00
 
     return {
         "total_users": total_users,
         "total_completed_sessions": total_completed_sessions,
         "total_abandoned_sessions": total_abandoned_sessions,
-        "num_reengagements": num_reengagements,  
-        "avg_session_duration": avg_session_duration  
+        "num_reengagements": rollup.get("reengagements", 0),  
+        "avg_session_duration": stats_rollups.average(rollup, "duration")  
     }
 
-def extract_keywords(texts):
+async def extract_keywords(texts):
     """
-    Uses GPT-4o-mini to extract the most relevant themes and their frequencies as a Python dictionary.
+    Uses the LLM to extract the most relevant themes and their frequencies (schema-validated JSON).
     """
 
     prompt = get_keyword_extraction_prompt(texts)
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
+        result = await request_structured(
+            "keywords",
+            [
                 {"role": "system", "content": "You are an expert in semantic keyword extraction and frequency analysis."},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.3
+            ThemeDistribution
         )
+    except Exception as e:
+        logger.warning("Theme extraction failed: %s", e)
+        return []
 
-        raw_response = response.choices[0].message.content
-
-        cleaned_response = raw_response.strip().replace("```python", "").replace("```", "").strip()
-
-        theme_frequencies = eval(cleaned_response) if cleaned_response.startswith("{") and cleaned_response.endswith("}") else {}
+    return [{"_id": item.theme, "count": round(item.frequency, 2)} for item in result.themes]
 
-        return [{"_id": theme, "count": round(freq, 2)} for theme, freq in theme_frequencies.items()]
+async def compute_diagram_data():
+    """
+    Full recomputation of the /diagrams payload (rollup averages + GPT-4o theme extraction).
+    Served through the materialized snapshot in services.diagram_snapshots.
+    """
 
-    except Exception as e:
-        return []
+    rollup = await stats_rollups.get_rollup()
 
-def get_diagram_data():
-
-    score_pipeline = [
-        {
-            "$group": {
-                "_id": None,
-                "avg_ai_score": {"$avg": "$assistant_influence_score"},
-                "avg_originality": {"$avg": "$originality_score"},
-                "avg_matching_score": {"$avg": "$matching_score"}
-            }
-        }
-    ]
-    score_result = list(analysis_collection.aggregate(score_pipeline))
-    avg_ai_score = round(score_result[0]["avg_ai_score"], 2) if score_result else 0.00
-    avg_originality = round(score_result[0]["avg_originality"], 2) if score_result else 0.00
-    avg_matching_score = round(score_result[0]["avg_matching_score"], 2) if score_result else 0.00 
-
-    size_pipeline = [
-        {
-            "$group": {
-                "_id": None,
-                "avg_user_msg_size": {"$avg": "$size_stats.avg_user_size"},
-                "avg_ai_msg_size": {"$avg": "$size_stats.avg_ai_size"}
-            }
-        }
-    ]
-    size_result = list(analysis_collection.aggregate(size_pipeline))
-    avg_user_msg_size = round(size_result[0]["avg_user_msg_size"], 2) if size_result else 0.00
-    avg_ai_msg_size = round(size_result[0]["avg_ai_msg_size"], 2) if size_result else 0.00
-
-    heatmap_pipeline = [
-        {
-            "$project": {
-                "originality_bucket": {
-                    "$switch": {
-                        "branches": [
-                            {"case": {"$lt": ["$originality_score", 25]}, "then": "0-25"},
-                            {"case": {"$lt": ["$originality_score", 50]}, "then": "25-50"},
-                            {"case": {"$lt": ["$originality_score", 75]}, "then": "50-75"},
-                            {"case": {"$lte": ["$originality_score", 100]}, "then": "75-100"}
-                        ],
-                        "default": "Unknown"
-                    }
-                },
-                "total_messages": "$time_stats.total_messages"
-            }
-        },
-        {
-            "$group": {
-                "_id": "$originality_bucket",
-                "avg_messages": {"$avg": "$total_messages"} 
-            }
-        },
-        {
-            "$sort": {"_id": 1}
-        }
-    ]
-    heatmap_result = list(analysis_collection.aggregate(heatmap_pipeline))
-
-    final_ideas = list(analysis_collection.find({"final_idea": {"$exists": True, "$ne": None}}, {"final_idea": 1}))
+    final_ideas = await repository.find_analyses({"final_idea": {"$exists": True, "$ne": None}}, {"final_idea": 1})
 
     all_texts = [doc["final_idea"] for doc in final_ideas]
 
-    theme_result = extract_keywords(all_texts)
+    theme_result = await extract_keywords(all_texts)
     return {
-        "avg_ai_score": avg_ai_score,
-        "avg_matching":avg_matching_score,
-        "avg_originality": avg_originality,
-        "avg_user_msg_size": avg_user_msg_size,
-        "avg_ai_msg_size": avg_ai_msg_size,
-        "heatmap_data": heatmap_result,
+        "avg_ai_score": stats_rollups.average(rollup, "ai_score"),
+        "avg_matching": stats_rollups.average(rollup, "matching"),
+        "avg_originality": stats_rollups.average(rollup, "originality"),
+        "avg_user_msg_size": stats_rollups.average(rollup, "user_msg_size"),
+        "avg_ai_msg_size": stats_rollups.average(rollup, "ai_msg_size"),
+        "heatmap_data": stats_rollups.heatmap_data(rollup),
         "theme_distribution": theme_result
     }
 
-def get_analysis_data(start_date=None, end_date=None):
+async def get_analysis_data(start_date=None, end_date=None):
     """
     Retrieve analysis data from MongoDB, with optional filtering by date.
     """
     query = {}
     if start_date and end_date:
-        query["created_at"] = {"$gte": start_date, "$lte": end_date}
-
-    analysis_data = list(analysis_collection.find(query, {
+        start_date, end_date = to_utc_datetime(start_date), to_utc_datetime(end_date)
+        # Analyses not yet migrated still hold naive-UTC ISO strings, which sort lexically.
+        legacy_format = "%Y-%m-%dT%H:%M:%S"
+        query["$or"] = [
+            {"created_at": {"$gte": start_date, "$lte": end_date}},
+            {"created_at": {"$gte": start_date.strftime(legacy_format), "$lte": end_date.strftime(legacy_format)}},
+        ]
+
+    analysis_data = await repository.find_analyses(query, {
         "_id": 0,
         "session_id": 1, 
         "prolific_id":1,
@@ -172,40 +102,178 @@ def get_analysis_data(start_date=None, end_date=None):
         "matching_score": 1, 
         "assistant_influence_score":1, 
         "matching_analysis": 1
-    }))
+    })
 
     return analysis_data
 
-def delete_analysis_entry(session_id):
+TIMESERIES_GRANULARITIES = ("hour", "day", "week")
+
+async def get_analysis_timeseries(granularity="day", start_date=None, end_date=None, tz="UTC"):
+    """
+    Analyses grouped by hour, day or week of `created_at` (in timezone `tz`), with
+    per-bucket counts and average scores/durations, aggregated server-side.
+    `end_date` is exclusive; naive bounds are local dates in `tz`.
+    Only analyses with a native datetime `created_at` are counted (see scripts/migrate_timestamps.py).
+    """
+    if granularity not in TIMESERIES_GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(TIMESERIES_GRANULARITIES)}")
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {tz}")
+
+    # Bounds are midnights in `tz`, like the $dateTrunc buckets, not UTC midnights.
+    created_at: Dict[str, Any] = {"$type": "date"}
+    if start_date:
+        if start_date.tzinfo is None:
+            start_date = start_date.replace(tzinfo=zone)
+        created_at["$gte"] = to_utc_datetime(start_date)
+    if end_date:
+        if end_date.tzinfo is None:
+            end_date = end_date.replace(tzinfo=zone)
+        created_at["$lt"] = to_utc_datetime(end_date)
+
+    bucket = {"date": "$created_at", "unit": granularity, "timezone": tz}
+    if granularity == "week":
+        bucket["startOfWeek"] = "monday"
+
+    return await repository.aggregate_analyses([
+        {"$match": {"created_at": created_at}},
+        {"$group": {
+            "_id": {"$dateTrunc": bucket},
+            "count": {"$sum": 1},
+            "avg_originality": {"$avg": "$originality_score"},
+            "avg_matching": {"$avg": "$matching_score"},
+            "avg_ai_score": {"$avg": "$assistant_influence_score"},
+            "avg_duration_minutes": {"$avg": "$time_stats.total_duration_minutes"},
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": {
+            "_id": 0,
+            "bucket": "$_id",
+            "count": 1,
+            "avg_originality": {"$round": ["$avg_originality", 2]},
+            "avg_matching": {"$round": ["$avg_matching", 2]},
+            "avg_ai_score": {"$round": ["$avg_ai_score", 2]},
+            "avg_duration_minutes": {"$round": ["$avg_duration_minutes", 2]},
+        }},
+    ])
+
+async def delete_analysis_entry(session_id):
     """
     Delete an analysis entry based on session_id from both 'analyses' and 'chats' collections.
     """
-    analysis_result = analysis_collection.delete_one({"session_id": session_id})
-    chat_result = chat_collection.delete_one({"session_id": session_id})
-    deleted = analysis_result.deleted_count > 0 or chat_result.deleted_count > 0
+    deleted_analysis = await repository.delete_analysis(session_id)
+    deleted_chat = await repository.delete_chat(session_id)
+    await stats_rollups.on_analysis_deleted(deleted_analysis)
+    await stats_rollups.on_chat_deleted(deleted_chat)
+    if deleted_analysis is not None:
+        await repository.bump_revision("analyses")
+    deleted = deleted_analysis is not None or deleted_chat is not None
     return {"deleted": deleted}
 
-async def fetch_all_users():
+SESSION_PAGE_MAX = 200
+
+# Summary columns of the admin table: no message bodies, no analysis paragraphs.
+SESSION_SUMMARY_ANALYSIS_FIELDS = {
+    "_id": 0,
+    "originality_score": 1,
+    "matching_score": 1,
+    "assistant_influence_score": 1,
+    "time_stats.total_messages": 1,
+    "time_stats.total_duration_minutes": 1,
+    "time_stats.user_returned_after_30mins": 1,
+    "created_at": 1,
+}
+
+def encode_page_cursor(created_at, session_id: str) -> str:
+    raw = json.dumps({"c": created_at.isoformat() if created_at else None, "s": session_id})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_page_cursor(cursor: str):
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        created_at = datetime.fromisoformat(raw["c"]) if raw["c"] else None
+        return created_at, raw["s"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+async def list_sessions(
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    order: str = "desc",
+    status: Optional[str] = None,
+    prolific_id: Optional[str] = None,
+) -> Dict[str, Any]:
     """
-    Récupère toutes les sessions complètes de analysis_collection et les sessions incomplètes de chat_collection.
+    Page of session summaries, keyset-paginated on (created_at, session_id).
+    `status` is "completed" (final idea submitted) or "in_progress".
+    Each row carries the analysis scores when the session was analyzed.
     """
-    analysis_data = list(analysis_collection.find({}, {
-        "_id": 0,
-        "session_id": 1,
-        "prolific_id":1,
-        "final_idea": 1,
-        "time_stats.total_messages": 1,
-        "time_stats.total_duration_minutes": 1,
-        "created_at": 1,
-        "time_stats.user_returned_after_30mins": 1,
-        "originality_score": 1,
-        "matching_score": 1,
-        "matching_analysis": 1
-    }))
-    chat_sessions = list(chat_collection.find({"final_idea": {"$exists": False}}, {"_id": 0, "session_id": 1,"conversation_history": 1,        "prolific_id":1,
-}))
-    all_sessions = analysis_data + chat_sessions  
-    return all_sessions
+    limit = max(1, min(limit, SESSION_PAGE_MAX))
+    direction = 1 if order == "asc" else -1
+    compare = "$gt" if direction == 1 else "$lt"
+
+    match: Dict[str, Any] = {}
+    if status == "completed":
+        match["final_idea"] = {"$exists": True}
+    elif status == "in_progress":
+        match["final_idea"] = {"$exists": False}
+    elif status is not None:
+        raise ValueError("status must be 'completed' or 'in_progress'")
+    if prolific_id:
+        match["prolific_id"] = prolific_id
+    if cursor:
+        created_at, session_id = decode_page_cursor(cursor)
+        match["$or"] = [
+            {"created_at": {compare: created_at}},
+            {"created_at": created_at, "session_id": {compare: session_id}},
+        ]
+
+    rows = await repository.aggregate_chats([
+        {"$match": match},
+        {"$sort": {"created_at": direction, "session_id": direction}},
+        {"$limit": limit + 1},
+        {"$lookup": {
+            "from": "analyses",
+            "localField": "session_id",
+            "foreignField": "session_id",
+            "pipeline": [{"$project": SESSION_SUMMARY_ANALYSIS_FIELDS}, {"$limit": 1}],
+            "as": "analysis",
+        }},
+        {"$project": {
+            "_id": 0,
+            "session_id": 1,
+            "prolific_id": 1,
+            "final_idea": 1,
+            "created_at": 1,
+            "completed": {"$ne": [{"$type": "$final_idea"}, "missing"]},
+            "message_count": {"$size": {"$ifNull": ["$conversation_history", []]}},
+            "analysis": {"$first": "$analysis"},
+        }},
+    ])
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_page_cursor(rows[-1].get("created_at"), rows[-1]["session_id"])
+    return {"items": rows, "next_cursor": next_cursor}
+
+async def get_session_messages(session_id: str, offset: int = 0, limit: int = 50) -> Optional[Dict[str, Any]]:
+    """
+    Slice of one session's conversation_history, loaded lazily by the admin page.
+    """
+    rows = await repository.aggregate_chats([
+        {"$match": {"session_id": session_id}},
+        {"$limit": 1},
+        {"$project": {
+            "_id": 0,
+            "session_id": 1,
+            "total": {"$size": {"$ifNull": ["$conversation_history", []]}},
+            "messages": {"$slice": [{"$ifNull": ["$conversation_history", []]}, max(0, offset), max(1, limit)]},
+        }},
+    ])
+    return rows[0] if rows else None
 
 async def fetch_users_by_session_id(session_id: str):
     """
@@ -215,22 +283,13 @@ async def fetch_users_by_session_id(session_id: str):
     3. Si non trouvée, vérifie seulement dans `chat_collection`.
     4. Si aucune donnée trouvée, retourne None.
     """
-    analysis_data = analysis_collection.find_one(
-        {"session_id": session_id},
-        {"_id": 0}  
-    )
+    analysis_data = await repository.find_analysis(session_id, {"_id": 0})
     if analysis_data:
-        chat_data = chat_collection.find_one(
-            {"session_id": session_id},
-            {"_id": 0} 
-        )
+        chat_data = await repository.find_chat(session_id, {"_id": 0})
         if chat_data:
             analysis_data["chat_session"] = chat_data
         return analysis_data
-    chat_data = chat_collection.find_one(
-        {"session_id": session_id},
-        {"_id": 0} 
-    )
+    chat_data = await repository.find_chat(session_id, {"_id": 0})
     return chat_data if chat_data else None
 
 async def get_config():
@@ -238,54 +297,16 @@ async def get_config():
     Fetch the configuration from the database.
     If no configuration exists, return None.
     """
-    if config_collection is None:
+    if repository.config_collection is None:
         raise ValueError("Database collection is not initialized")
-    config = config_collection.find_one({}, {"_id": 0})  
+    config = await repository.find_config({"_id": 0, "version": 0})
     return config if config else None
 
 async def update_config(config_data: ConfigModel):
     """
     Update or insert a new configuration in the database.
     """
-    if config_collection is None:
+    if repository.config_collection is None:
         raise ValueError("Database collection is not initialized")
-    existing_config = await get_config() 
-    if existing_config:
-        config_collection.update_one({}, {"$set": config_data.dict()})
-    else:
-        config_collection.insert_one(config_data.dict())
-    fresh = await get_config()
-    cache_config.config_cache = fresh
-    return fresh
-
-async def get_chats(ids: List[str]) -> List[dict]:
-    chats = []
-    for session_id in ids:
-        chat_data = chat_collection.find_one(
-            {"session_id": session_id},
-            {"_id": 0}  
-        )
-        if chat_data is not None:
-            chats.append(chat_data)
-    return chats
-
-async def get_analysis(ids: List[str], file_format: Optional[str] = None) -> List[Dict[str, Any]]:
-    """
-    Récupère les documents dans la collection 'analyses' correspondant aux IDs fournis.
-    La variable file_format peut servir à adapter le format de retour.
-    """
-    analyses = []
-    for session_id in ids:
-        analysis_data = analysis_collection.find_one(
-            {"session_id": session_id},
-            {"_id": 0}  
-        )
-        if analysis_data is not None:
-            analyses.append(analysis_data)
-    return analyses
-
-async def get_all(ids: List[str], file_format: Optional[str] = None) -> Dict[str, List[Dict[str, Any]]]:
-    """Combine les données des collections 'chats' et 'analyses'."""
-    chats = await get_chats(ids)
-    analyses = await get_analysis(ids, file_format)
-    return {"chats": chats, "analyses": analyses}
\ No newline at end of file
+    await repository.upsert_config(config_data.dict())
+    return await refresh_config_cache()
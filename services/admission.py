@@ -0,0 +1,106 @@
+import os
+import math
+import asyncio
+import time
+from typing import Any, Dict, List
+from services import repository
+
+BUCKET_ID = "llm"
+# Quota of the chat deployment, shared by every worker through the Mongo bucket.
+LLM_RPM_LIMIT = float(os.getenv("LLM_RPM_LIMIT", "300"))
+LLM_TPM_LIMIT = float(os.getenv("LLM_TPM_LIMIT", "150000"))
+# Completion tokens reserved for a chat turn on top of the prompt (the reply length is unknown upfront).
+CHAT_COMPLETION_TOKEN_ESTIMATE = int(os.getenv("CHAT_COMPLETION_TOKEN_ESTIMATE", "600"))
+# A request waits at most this long for capacity; beyond it the client is told to retry later.
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", "3"))
+# Requests waiting in this worker's queue beyond this count are rejected immediately.
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "50"))
+
+# asyncio.Lock wakes its waiters in arrival order: only the head of the queue polls the bucket.
+_queue_lock = asyncio.Lock()
+_waiting = 0
+
+
+class AdmissionRejected(Exception):
+    """
+    No LLM capacity within the allowed wait; the client should retry after `retry_after` seconds.
+    """
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM capacity exhausted, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+def _take_pipeline(tokens: int) -> List[Dict[str, Any]]:
+    """
+    Refill both buckets for the time elapsed since the last update (server clock, so
+    workers agree), then take one request and `tokens` tokens only if both are available.
+    """
+    elapsed_minutes = {"$divide": [
+        {"$max": [0, {"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}]},
+        60000,
+    ]}
+    return [
+        {"$set": {
+            "requests": {"$min": [LLM_RPM_LIMIT, {"$add": [
+                {"$ifNull": ["$requests", LLM_RPM_LIMIT]}, {"$multiply": [elapsed_minutes, LLM_RPM_LIMIT]},
+            ]}]},
+            "tokens": {"$min": [LLM_TPM_LIMIT, {"$add": [
+                {"$ifNull": ["$tokens", LLM_TPM_LIMIT]}, {"$multiply": [elapsed_minutes, LLM_TPM_LIMIT]},
+            ]}]},
+            "updated_at": "$$NOW",
+        }},
+        {"$set": {"admitted": {"$and": [{"$gte": ["$requests", 1]}, {"$gte": ["$tokens", tokens]}]}}},
+        {"$set": {
+            "requests": {"$cond": ["$admitted", {"$subtract": ["$requests", 1]}, "$requests"]},
+            "tokens": {"$cond": ["$admitted", {"$subtract": ["$tokens", tokens]}, "$tokens"]},
+        }},
+    ]
+
+
+async def _try_take(tokens: int) -> float:
+    """
+    Returns 0 if admitted, otherwise the seconds until the bucket can cover the request.
+    """
+    bucket = await repository.update_rate_limit(BUCKET_ID, _take_pipeline(tokens))
+    if bucket["admitted"]:
+        return 0.0
+    missing_requests = max(0.0, 1 - bucket["requests"])
+    missing_tokens = max(0.0, tokens - bucket["tokens"])
+    return max(missing_requests / LLM_RPM_LIMIT, missing_tokens / LLM_TPM_LIMIT) * 60
+
+
+async def admit(tokens: int, max_wait: float = ADMISSION_MAX_WAIT) -> None:
+    """
+    Reserve one request and `tokens` tokens of the shared LLM budget, waiting in
+    FIFO order for at most `max_wait` seconds. Raises AdmissionRejected otherwise.
+    """
+    global _waiting
+    # A request larger than the whole per-minute budget could never be served.
+    tokens = min(tokens, int(LLM_TPM_LIMIT))
+    if _waiting >= ADMISSION_QUEUE_SIZE:
+        raise AdmissionRejected(max_wait)
+
+    deadline = time.monotonic() + max_wait
+    _waiting += 1
+    try:
+        try:
+            await asyncio.wait_for(_queue_lock.acquire(), timeout=max_wait)
+        except asyncio.TimeoutError:
+            raise AdmissionRejected(max_wait)
+        try:
+            while True:
+                wait = await _try_take(tokens)
+                if wait == 0:
+                    return
+                remaining = deadline - time.monotonic()
+                if wait > remaining:
+                    raise AdmissionRejected(wait)
+                await asyncio.sleep(wait)
+        finally:
+            _queue_lock.release()
+    finally:
+        _waiting -= 1
+
+
+def retry_after_header(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
@@ -0,0 +1,173 @@
+import os
+import uuid
+import random
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from services import repository, stats_rollups
+from services.analysis_service import run_session_analysis
+from utils.background import spawn
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_BATCH_CONCURRENCY = int(os.getenv("ANALYSIS_BATCH_CONCURRENCY", "8"))
+ANALYSIS_BATCH_MAX_RETRIES = int(os.getenv("ANALYSIS_BATCH_MAX_RETRIES", "2"))
+# Upper bounds for the values a caller may request, whatever the request says.
+ANALYSIS_BATCH_CONCURRENCY_LIMIT = int(os.getenv("ANALYSIS_BATCH_CONCURRENCY_LIMIT", "16"))
+ANALYSIS_BATCH_MAX_RETRIES_LIMIT = int(os.getenv("ANALYSIS_BATCH_MAX_RETRIES_LIMIT", "5"))
+# Number of analyses buffered before they are bulk-written and progress is reported.
+ANALYSIS_BATCH_WRITE_SIZE = int(os.getenv("ANALYSIS_BATCH_WRITE_SIZE", "50"))
+# Failed session ids kept on the batch document, to keep it small.
+MAX_REPORTED_FAILURES = 200
+
+_CHAT_PROJECTION = {"_id": 0, "session_id": 1, "prolific_id": 1, "final_idea": 1, "conversation_history": 1}
+
+
+async def start_batch(
+    session_ids: Optional[List[str]] = None,
+    completed_only: bool = True,
+    concurrency: Optional[int] = None,
+    max_retries: Optional[int] = None,
+) -> dict:
+    """
+    Create a re-analysis batch over `session_ids` (or every session, completed ones
+    only by default) and run it in the background. Returns the batch document.
+    `concurrency` and `max_retries` are clamped to the server-side limits.
+    """
+    query = {}
+    if session_ids:
+        query["session_id"] = {"$in": session_ids}
+    if completed_only:
+        query["final_idea"] = {"$exists": True}
+
+    now = datetime.now(timezone.utc)
+    batch = {
+        "batch_id": uuid.uuid4().hex,
+        "status": "running",
+        "concurrency": min(max(1, concurrency or ANALYSIS_BATCH_CONCURRENCY), ANALYSIS_BATCH_CONCURRENCY_LIMIT),
+        "max_retries": min(
+            max(0, ANALYSIS_BATCH_MAX_RETRIES if max_retries is None else max_retries),
+            ANALYSIS_BATCH_MAX_RETRIES_LIMIT,
+        ),
+        "total": await repository.count_chats(query),
+        "processed": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "failed_sessions": [],
+        "created_at": now,
+        "updated_at": now,
+    }
+    await repository.insert_analysis_batch(batch)
+    spawn(_run_batch(batch, query))
+    return batch
+
+
+async def get_batch(batch_id: str):
+    return await repository.find_analysis_batch(batch_id)
+
+
+async def _analyze_with_retries(session_doc: dict, max_retries: int) -> dict:
+    for attempt in range(max_retries + 1):
+        try:
+            return await run_session_analysis(session_doc, session_doc.get("prolific_id"))
+        except Exception:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+async def _run_batch(batch: dict, query: dict):
+    batch_id = batch["batch_id"]
+    queue: asyncio.Queue = asyncio.Queue(maxsize=batch["concurrency"] * 2)
+    # (session_id, operation) pairs waiting to be bulk-written.
+    pending: List[Tuple[str, UpdateOne]] = []
+    failures: List[str] = []
+    counters = {"succeeded": 0, "failed": 0}
+    flush_lock = asyncio.Lock()
+
+    async def flush():
+        """
+        Write the buffered analyses and report progress. Never raises: sessions whose
+        write failed are counted as failed, so the batch always reaches a final status.
+        """
+        async with flush_lock:
+            writes, pending[:] = list(pending), []
+            failed, failures[:] = list(failures), []
+            succeeded, failed_count = counters["succeeded"], counters["failed"]
+            counters["succeeded"] = counters["failed"] = 0
+            if writes:
+                try:
+                    await repository.bulk_write_analyses([operation for _, operation in writes])
+                except BulkWriteError as e:
+                    # Unordered bulk write: only the reported operations failed.
+                    lost = [writes[error["index"]][0] for error in e.details.get("writeErrors", [])]
+                    logger.error("Batch %s: %d analysis writes failed", batch_id, len(lost))
+                    failed += lost
+                    succeeded -= len(lost)
+                    failed_count += len(lost)
+                except Exception:
+                    logger.exception("Batch %s: analysis bulk write failed", batch_id)
+                    failed += [session_id for session_id, _ in writes]
+                    succeeded -= len(writes)
+                    failed_count += len(writes)
+            try:
+                await repository.update_analysis_batch(batch_id, {
+                    "$inc": {
+                        "processed": succeeded + failed_count,
+                        "succeeded": succeeded,
+                        "failed": failed_count,
+                    },
+                    "$push": {"failed_sessions": {"$each": failed, "$slice": MAX_REPORTED_FAILURES}},
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                })
+            except Exception:
+                logger.exception("Batch %s: progress update failed", batch_id)
+
+    async def worker():
+        while True:
+            session_doc = await queue.get()
+            if session_doc is None:
+                return
+            try:
+                analysis = await _analyze_with_retries(session_doc, batch["max_retries"])
+                pending.append((
+                    analysis["session_id"],
+                    UpdateOne(
+                        {"session_id": analysis["session_id"]},
+                        repository.analysis_upsert_update(analysis),
+                        upsert=True
+                    ),
+                ))
+                counters["succeeded"] += 1
+            except Exception:
+                failures.append(session_doc["session_id"])
+                counters["failed"] += 1
+            if len(pending) + len(failures) >= ANALYSIS_BATCH_WRITE_SIZE:
+                await flush()
+
+    workers = [asyncio.create_task(worker()) for _ in range(batch["concurrency"])]
+    status = "done"
+    try:
+        async for session_doc in repository.iter_chats(query, _CHAT_PROJECTION):
+            await queue.put(session_doc)
+    except Exception:
+        logger.exception("Batch %s: reading sessions failed", batch_id)
+        status = "failed"
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers, return_exceptions=True)
+        await flush()
+        try:
+            # Bulk updates do not report the documents they overwrote: recompute the rollup once,
+            # then bump the revision so the diagram snapshot is rebuilt from the new rollup.
+            await stats_rollups.rebuild_rollups()
+            await repository.bump_revision("analyses")
+        except Exception:
+            logger.exception("Batch %s: rollup rebuild failed", batch_id)
+        await repository.update_analysis_batch(batch_id, {
+            "$set": {"status": status, "updated_at": datetime.now(timezone.utc)},
+        })
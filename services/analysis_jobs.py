@@ -0,0 +1,96 @@
+import os
+import uuid
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError
+from services import repository, stats_rollups
+from services.analysis_service import run_session_analysis, compute_analysis_hash
+from utils.background import spawn
+
+# Number of analyses a worker runs at the same time; further jobs wait in its queue.
+ANALYSIS_MAX_CONCURRENCY = int(os.getenv("ANALYSIS_MAX_CONCURRENCY", "2"))
+# A queued/running job older than this is considered lost (e.g. worker restart) and can be re-enqueued.
+ANALYSIS_JOB_STALE_SECONDS = int(os.getenv("ANALYSIS_JOB_STALE_SECONDS", "600"))
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_slots = asyncio.Semaphore(ANALYSIS_MAX_CONCURRENCY)
+
+
+async def enqueue_analysis(session_id: str, prolific_id: str) -> dict:
+    """
+    Queue an analysis for `session_id` and return its job document right away.
+    If a job for this session is already queued or running, that job is returned instead.
+    """
+    now = datetime.now(timezone.utc)
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "session_id": session_id,
+        "prolific_id": prolific_id,
+        "status": JOB_QUEUED,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+    reusable = {
+        "session_id": session_id,
+        "$or": [
+            {"status": {"$in": [JOB_DONE, JOB_FAILED]}},
+            {"updated_at": {"$lt": now - timedelta(seconds=ANALYSIS_JOB_STALE_SECONDS)}},
+        ],
+    }
+    try:
+        if await repository.replace_analysis_job(reusable, job) is None:
+            await repository.insert_analysis_job(job)
+    except DuplicateKeyError:
+        existing = await repository.find_analysis_job({"session_id": session_id})
+        if existing:
+            return existing
+        raise
+
+    spawn(_run_job(job))
+    return job
+
+
+async def get_job(job_id: str):
+    return await repository.find_analysis_job({"job_id": job_id})
+
+
+async def _run_job(job: dict):
+    async with _slots:
+        job_id = job["job_id"]
+        await repository.update_analysis_job(job_id, {"status": JOB_RUNNING, "updated_at": datetime.now(timezone.utc)})
+        try:
+            session_doc = await repository.find_chat(job["session_id"])
+            if not session_doc:
+                raise ValueError("Session not found")
+            stored = await repository.find_analysis(job["session_id"], {"_id": 0})
+            analysis_hash = compute_analysis_hash(
+                session_doc.get("conversation_history", []), session_doc.get("final_idea", "")
+            )
+            if stored and stored.get("analysis_hash") == analysis_hash:
+                # Nothing changed since the stored analysis (e.g. a client retry): no write at all.
+                analysis_result = stored
+            else:
+                analysis_result = await run_session_analysis(session_doc, job["prolific_id"])
+                previous = await repository.upsert_analysis(dict(analysis_result))
+                await stats_rollups.on_analysis_written(previous, analysis_result)
+                await repository.bump_revision("analyses")
+                if previous and previous.get("created_at"):
+                    analysis_result["created_at"] = previous["created_at"]
+        except Exception as e:
+            await repository.update_analysis_job(job_id, {
+                "status": JOB_FAILED,
+                "error": str(e),
+                "updated_at": datetime.now(timezone.utc),
+            })
+            return
+        await repository.update_analysis_job(job_id, {
+            "status": JOB_DONE,
+            "result": analysis_result,
+            "updated_at": datetime.now(timezone.utc),
+        })
@@ -1,160 +1,110 @@
-import ast
-from openai import AzureOpenAI
-import os
-from dotenv import load_dotenv
-from datetime import datetime
-from utils.prompt_config import get_analysis_prompt
-
-load_dotenv()
-
-try:
-    client = AzureOpenAI(
-    api_key=os.getenv("API_KEY"),
-    api_version=os.getenv("OPENAI_API_VERSION"),
-    azure_endpoint=os.getenv("API_BASE")
-)
-except Exception as e:
-    raise RuntimeError(f"Erreur lors de l'initialisation du client Azure OpenAI : {e}")
-
-def format_duration(seconds):
-    if seconds >= 3600:
-        return f"≈ {round(seconds / 3600, 2)} h"
-    elif seconds >= 60:
-        return f"≈ {round(seconds / 60, 2)} min"
-    else:
-        return f"≈ {round(seconds, 2)} sec"
+import json
+import hashlib
+from utils.time_utils import utc_now
+from utils.prompt_config import get_analysis_prompt, ANALYSIS_PROMPT_VERSION
+from services import repository
+from services.llm_gateway import LLM_SETTINGS
+from services.session_stats import compute_session_stats
+from services.structured_output import request_structured
+from models.models import AnalysisResult
+
+ANALYSIS_MODEL = LLM_SETTINGS["analysis"]["model"]
 
 def compute_avg_ai_latency(conversation_history):
-    # Sort messages chronologically
-    messages = sorted(conversation_history, key=lambda m: m["timestamp"])
-
-    for msg in messages:
-        ts = msg["timestamp"].split(".")[0]  # strip microseconds
-        if ts.endswith("Z"):
-            ts = ts[:-1] + "+00:00"
-        msg["dt"] = datetime.fromisoformat(ts)
-
-    latencies = []
-    user_count = 0
-
-    for i, msg in enumerate(messages):
-        if msg["role"] == "user":
-            user_count += 1
-            if user_count == 1:
-                continue  # skip first user msg
-
-            # find previous assistant
-            for j in range(i - 1, -1, -1):
-                if messages[j]["role"] == "assistant":
-                    delta = (msg["dt"] - messages[j]["dt"]).total_seconds()
-                    if delta > 0:
-                        latencies.append(delta)
-                    break
-
-    if not latencies:
-        return "N/A"
-
-    avg = sum(latencies) / len(latencies)
-    return format_duration(avg)
+    time_stats, _ = compute_session_stats(conversation_history)
+    return time_stats["avg_ai_latency_seconds"] if conversation_history else "N/A"
 
 def compute_time_stats(conversation_history):
-    if not conversation_history:
-        return {
-            "total_messages": 0,
-            "total_duration_minutes": 0.0,
-            "num_gaps_over_30mins": 0,
-            "user_returned_after_30mins": False,
-            "avg_ai_latency_seconds": 0.0
-        }
-
-    # Convert timestamps and sort
-    messages = sorted(conversation_history, key=lambda m: m["timestamp"])
-    for msg in messages:
-        ts = msg["timestamp"]
-        if ts.endswith("Z"):
-            ts = ts[:-1] + "+00:00"
-        msg["dt"] = datetime.fromisoformat(ts)
-
-    total_messages = len(messages)
-    total_active = 0.0
-    num_gaps = 0
-
-    # Total active duration + gaps
-    for i in range(len(messages) - 1):
-        dt1 = messages[i]["dt"]
-        dt2 = messages[i + 1]["dt"]
-        delta_min = (dt2 - dt1).total_seconds() / 60.0
-
-        if delta_min > 30:
-            num_gaps += 1
-        else:
-            total_active += delta_min
-
-
-    avg_latency = compute_avg_ai_latency(conversation_history)
-
-    return {
-        "total_messages": total_messages,
-        "total_duration_minutes": round(total_active, 2),
-        "num_gaps_over_30mins": num_gaps,
-        "user_returned_after_30mins": num_gaps > 0,
-        "avg_ai_latency_seconds": avg_latency
-    }
+    time_stats, _ = compute_session_stats(conversation_history)
+    return time_stats
 
 def compute_size_stats(conversation_history):
     """
     Calcule la taille (nombre de caractères) moyenne des messages
     pour l'utilisateur et pour l'assistant.
     """
-    user_sizes = []
-    assistant_sizes = []
-
-    for msg in conversation_history:
-        size = msg.get("size", len(msg["content"]))
-        if msg["role"] == "user":
-            user_sizes.append(size)
-        elif msg["role"] == "assistant":
-            assistant_sizes.append(size)
+    _, size_stats = compute_session_stats(conversation_history)
+    return size_stats
 
-    avg_user_size = sum(user_sizes) / len(user_sizes) if user_sizes else 0
-    avg_ai_size = sum(assistant_sizes) / len(assistant_sizes) if assistant_sizes else 0
-
-    return {
-        "avg_user_size": avg_user_size,
-        "avg_ai_size": avg_ai_size
+async def analyze_final_idea(conversation_history, final_idea):
+    """
+    LLM evaluation of the final idea, as a schema-validated AnalysisResult.
+    Raises StructuredOutputError (a ValueError) if no valid reply could be obtained.
+    """
+    prompt = get_analysis_prompt(conversation_history, final_idea)
+    result = await request_structured(
+        "analysis",
+        [
+            {
+                "role": "system",
+                "content": (
+                    "Tu es un expert en évaluation d'idées. "
+                    "Tu dois renvoyer UNIQUEMENT un objet JSON conforme au schéma demandé."
+                )
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        AnalysisResult
+    )
+    analysis_details = result.analysis_details.model_dump()
+    return result.originality_score, result.matching_score, analysis_details, result.assistant_influence_score
+
+def compute_analysis_hash(conversation_history, final_idea):
+    """
+    Content address of an evaluation: everything the LLM sees (messages and final
+    idea) plus the prompt version and model. Same hash => same evaluation.
+    """
+    payload = {
+        "conversation": [[msg["role"], msg["content"]] for msg in conversation_history],
+        "final_idea": final_idea,
+        "prompt_version": ANALYSIS_PROMPT_VERSION,
+        "model": ANALYSIS_MODEL,
     }
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
 
-def analyze_final_idea(conversation_history, final_idea):
-    prompt = get_analysis_prompt(conversation_history, final_idea)
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o", 
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "Tu es un expert en évaluation d'idées. "
-                        "Tu dois renvoyer UNIQUEMENT un dictionnaire Python valide."
-                    )
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.0
+async def run_session_analysis(session_doc, prolific_id):
+    """
+    Build the full analysis document of a chat session: time/size stats plus the
+    GPT-4o evaluation of the final idea. The evaluation is reused from any stored
+    analysis with the same content hash; otherwise the LLM is called.
+    """
+    conversation_history = session_doc.get("conversation_history", [])
+    final_idea = session_doc.get("final_idea", "")
+
+    time_stats, size_stats = compute_session_stats(conversation_history)
+
+    analysis_hash = compute_analysis_hash(conversation_history, final_idea)
+    cached = await repository.find_analysis_by_hash(analysis_hash, {
+        "_id": 0,
+        "originality_score": 1,
+        "matching_score": 1,
+        "assistant_influence_score": 1,
+        "matching_analysis": 1,
+    })
+    if cached:
+        originality_score = cached.get("originality_score", 0)
+        matching_score = cached.get("matching_score", 0)
+        assistant_influence_score = cached.get("assistant_influence_score", 0)
+        matching_analysis = cached.get("matching_analysis", {})
+    else:
+        originality_score, matching_score, matching_analysis, assistant_influence_score = await analyze_final_idea(
+            conversation_history, final_idea
         )
-        raw_response = response.choices[0].message.content
-        parsed = ast.literal_eval(raw_response)
-        originality_score = parsed.get('originality_score', 0)
-        matching_score = parsed.get('matching_score', 0)
-        assistant_influence_score = parsed.get('assistant_influence_score', 0)
-        analysis_details = parsed.get('analysis_details', {})
-
-    except Exception as e:
-        originality_score = 0
-        matching_score = 0
-        assistant_influence_score = 0
-        analysis_details = f"Erreur lors de la récupération du dict Python : {str(e)}"
 
-    return originality_score, matching_score, analysis_details, assistant_influence_score
+    return {
+        "session_id": session_doc["session_id"],
+        "prolific_id": prolific_id,
+        "final_idea": final_idea,
+        "time_stats": time_stats,
+        "size_stats": size_stats,
+        "originality_score": originality_score,
+        "matching_score": matching_score,
+        "assistant_influence_score": assistant_influence_score,
+        "matching_analysis": matching_analysis,
+        "analysis_hash": analysis_hash,
+        "created_at": utc_now(),
+    }
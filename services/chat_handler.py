@@ -1,93 +1,165 @@
+import os
 import asyncio
-from datetime import datetime
-from zoneinfo import ZoneInfo
+from typing import AsyncIterator, Optional
 from fastapi import HTTPException
 from fastapi.responses import StreamingResponse
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
-from services.chat_service import get_buffer_for_session, wrapped_client
-from services.saveConversation_service import save_conversation, load_conversation 
+from services.chat_service import get_buffer_for_session, record_message
+from openai import RateLimitError
+from services import llm_gateway, stream_buffers
+from services.admission import admit, AdmissionRejected, retry_after_header, CHAT_COMPLETION_TOKEN_ESTIMATE
+from services.saveConversation_service import save_conversation, load_session_state, new_message_id
+from services.context_builder import build_context, needs_summary, refresh_summary
 from utils.prompt_config import get_chat_prompt
-from services.mongodb_connection import MongoDBManager
-from services.admin_services import get_config 
-from utils import cache_config
+from services.config_service import get_cached_config
+from utils.background import spawn
+from utils.time_utils import utc_now
+from utils.stream_framing import coalesce, sse_stream, SSE_MEDIA_TYPE, SSE_HEADERS
 
-CANADA_TZ = ZoneInfo("America/Toronto")
-db_manager = MongoDBManager()
+# Délai optionnel (en secondes) entre deux tokens envoyés au client ; 0 = pas de pacing.
+STREAM_TOKEN_DELAY = float(os.getenv("STREAM_TOKEN_DELAY", "0"))
+# Un participant attend la réponse : peu de retries, un 429 persistant lui est renvoyé avec Retry-After.
+CHAT_MAX_RETRIES = int(os.getenv("CHAT_MAX_RETRIES", "1"))
 
-async def process_chat_stream(message: str, session_id: str, conversation_history: list) -> StreamingResponse:
-    if cache_config.config_cache is None:
-        cache_config.config_cache = await get_config()
-    genderTone = cache_config.config_cache.get("genderTone")
-    tone = cache_config.config_cache.get("tone")
+async def process_chat_stream(
+    message: str,
+    session_id: str,
+    conversation_history: list,
+    sse: bool = False,
+    client_message_id: Optional[str] = None,
+) -> StreamingResponse:
+    # Message renvoyé par le client après une coupure (même X-Client-Message-Id) :
+    # on se rattache à sa génération au lieu d'appeler le modèle une seconde fois.
+    resent_stream_id = await stream_buffers.find_resent(session_id, client_message_id)
+    if resent_stream_id:
+        return _stream_response(resent_stream_id, sse=sse)
+
+    config = await get_cached_config() or {}
+    genderTone = config.get("genderTone")
+    tone = config.get("tone")
 
     SYSTEM_INSTRUCTIONS = get_chat_prompt(tone, genderTone)
 
+    context_summary = None
     if not conversation_history:
-        conversation_history = await load_conversation(session_id)
+        conversation_history, context_summary = await load_session_state(session_id)
 
-    memory_buffer = get_buffer_for_session(session_id)
-    if conversation_history and conversation_history[-1]["role"] == "user":
+    memory_buffer = get_buffer_for_session(session_id, conversation_history)
+    new_messages = []
+    if (
+        conversation_history
+        and conversation_history[-1]["role"] == "user"
+        and conversation_history[-1]["content"] == message
+    ):
         print("Message déjà présent, on ne l'ajoute pas.")
     else:
-        user_timestamp = datetime.now(CANADA_TZ).isoformat()
+        user_timestamp = utc_now()
         user_message_metadata = {
+            "message_id": new_message_id(),
             "role": "user",
             "content": message,
             "timestamp": user_timestamp,
             "size": len(message)
         }
         conversation_history.append(user_message_metadata)
+        new_messages.append(user_message_metadata)
         new_message = ChatMessage(
             role=MessageRole.USER,
             content=message
         )
-        memory_buffer.put(new_message)
-    chat_history = memory_buffer.get()
-    messages_to_send = [{"role": "system", "content": SYSTEM_INSTRUCTIONS}]
-    messages_to_send += [{"role": msg.role.value.lower(), "content": msg.content} for msg in chat_history[-10:]]
-  
+        record_message(session_id, new_message)
+    chat_history = list(memory_buffer.get_all())
+    messages_to_send, first_included, prompt_tokens = build_context(SYSTEM_INSTRUCTIONS, chat_history, context_summary)
+
     try:
-        response = wrapped_client._client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages_to_send,
-            temperature=0.3,
-            stream=True
-        )
+        await admit(prompt_tokens + CHAT_COMPLETION_TOKEN_ESTIMATE)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail="Trop de requêtes, réessayez plus tard.", headers=retry_after_header(e.retry_after))
+
+    try:
+        response = await llm_gateway.open_stream("chat", messages_to_send, max_retries=CHAT_MAX_RETRIES)
+    except RateLimitError as e:
+        # Le quota Azure est atteint malgré les retries : le client doit réessayer, ce n'est pas une erreur serveur.
+        raise HTTPException(status_code=429, detail="Trop de requêtes, réessayez plus tard.", headers=retry_after_header(llm_gateway.retry_after(e) or 1))
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Erreur OpenAI: {str(e)}")
-    async def generate():
-        full_response = ""
-        async for chunk in _iterate_response(response):
-            full_response += chunk
-            yield chunk
-        assistant_timestamp = datetime.now(CANADA_TZ).isoformat()
+    async def persist_answer(full_response: str, truncated: bool):
+        # Réponse complète, ou partielle (truncated) si le client n'est pas revenu ou si le stream a échoué.
+        if not full_response:
+            # Rien n'a été généré : on n'enregistre pas un message utilisateur sans réponse,
+            # le participant renverra son message (la mémoire de session se réhydrate depuis la base).
+            return
         assistant_message_metadata = {
+            "message_id": new_message_id(),
             "role": "assistant",
             "content": full_response,
-            "timestamp": assistant_timestamp,
+            "timestamp": utc_now(),
             "size": len(full_response)
         }
+        if truncated:
+            assistant_message_metadata["truncated"] = True
         conversation_history.append(assistant_message_metadata)
-        assistant_message = ChatMessage(role=MessageRole.ASSISTANT, content=full_response)
-        memory_buffer.put(assistant_message)
-        await save_conversation(session_id, conversation_history)
-    
-    return StreamingResponse(generate(), media_type="text/plain")
+        new_messages.append(assistant_message_metadata)
+        record_message(session_id, ChatMessage(role=MessageRole.ASSISTANT, content=full_response))
+        await save_conversation(session_id, new_messages)
+        if needs_summary(context_summary, first_included):
+            spawn(refresh_summary(session_id, chat_history, context_summary, first_included))
+
+    # La génération tourne dans une tâche détachée de la réponse HTTP : une connexion
+    # coupée peut reprendre le stream (resume_chat_stream) sans nouvel appel au modèle.
+    stream_id = stream_buffers.new_stream_id()
+    await stream_buffers.start(
+        stream_id,
+        session_id,
+        client_message_id,
+        _iterate_response(response, STREAM_TOKEN_DELAY),
+        response.aclose,
+        persist_answer,
+    )
+    return _stream_response(stream_id, sse=sse)
+
+async def resume_chat_stream(stream_id: str, session_id: str, offset: int = 0, sse: bool = False) -> StreamingResponse:
+    """
+    Reprend un stream de réponse à partir du caractère `offset` (texte déjà reçu par le client).
+    """
+    if not await stream_buffers.find_stream(stream_id, session_id):
+        raise HTTPException(status_code=404, detail="Stream introuvable ou expiré")
+    return _stream_response(stream_id, offset, sse)
+
+def _stream_response(stream_id: str, offset: int = 0, sse: bool = False) -> StreamingResponse:
+    """
+    Tokens regroupés (quelques dizaines de ms / octets par écriture), en texte brut
+    ou en SSE avec des ids d'événements (offsets de reprise) et des heartbeats.
+    """
+    pieces = stream_buffers.follow(stream_id, offset)
+    headers = {stream_buffers.STREAM_ID_HEADER: stream_id}
+    if sse:
+        return _ClosingStreamingResponse(
+            sse_stream(pieces, offset),
+            media_type=SSE_MEDIA_TYPE,
+            headers={**headers, **SSE_HEADERS}
+        )
+    return _ClosingStreamingResponse(coalesce(pieces), media_type="text/plain", headers=headers)
 
-async def _iterate_response(response) -> asyncio.StreamReader:
+class _ClosingStreamingResponse(StreamingResponse):
     """
-    Itère sur les chunks de la réponse de manière asynchrone.
+    Ferme le générateur dès la fin de la réponse (y compris sur déconnexion du client),
+    au lieu d'attendre que le garbage collector le finalise.
     """
-    for chunk in response:
+    async def __call__(self, scope, receive, send):
         try:
-            choices = chunk.choices
-            if choices and len(choices) > 0:
-                delta = choices[0].delta
-                token = getattr(delta, "content", "")
-                if token:
-                    await asyncio.sleep(0.05)
-                    yield token
-        except Exception as e:
-            continue
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+
+async def _iterate_response(response, delay: float = 0.0) -> AsyncIterator[str]:
+    """
+    Itère sur les tokens du stream (llm_gateway.TextStream) sans bloquer la boucle d'événements.
+    Si `delay` > 0, les tokens sont espacés d'au moins ce délai (pacing optionnel).
+    """
+    async for token in response:
+        if delay > 0:
+            await asyncio.sleep(delay)
+        yield token
@@ -1,41 +1,33 @@
 import os
 import asyncio
-from typing import List, Any, Iterator, AsyncIterator, Dict
+from typing import List, Iterator, AsyncIterator
 from dotenv import load_dotenv
-from openai import AzureOpenAI
 from pydantic import PrivateAttr
 from llama_index.core.llms.llm import LLM
 from llama_index.core.base.llms.types import ChatMessage, MessageRole
 from pydantic import BaseModel as PydanticBaseModel
 from llama_index.core.memory.chat_summary_memory_buffer import ChatSummaryMemoryBuffer
+from services.session_memory import SessionMemoryStore
+from services import llm_gateway
 
 load_dotenv()
 
-API_KEY = os.getenv("API_KEY")
-API_VERSION = os.getenv("OPENAI_API_VERSION")
-API_BASE = os.getenv("API_BASE")
-
-if not API_KEY or not API_VERSION or not API_BASE:
-    raise ValueError("Les variables d'environnement API_KEY, OPENAI_API_VERSION et API_BASE doivent être définies.")
-
-try:
-    client = AzureOpenAI(
-        api_key=API_KEY,
-        api_version=API_VERSION,
-        azure_endpoint=API_BASE
-    )
-except Exception as e:
-    raise RuntimeError(f"Erreur lors de l'initialisation du client Azure OpenAI : {e}")
+SESSION_MEMORY_MAX_SESSIONS = int(os.getenv("SESSION_MEMORY_MAX_SESSIONS", "1000"))
+SESSION_MEMORY_IDLE_TTL = float(os.getenv("SESSION_MEMORY_IDLE_TTL", "1800"))
+SESSION_MEMORY_MAX_BYTES = int(os.getenv("SESSION_MEMORY_MAX_BYTES", "50000000"))
 
 class ChatResult(PydanticBaseModel):
     message: ChatMessage
 
 class AzureOpenAIWrapper(LLM):
-    _client: Any = PrivateAttr()
-    
-    def __init__(self, client, context_window: int = 4096):
+    """
+    llama-index adapter over the shared LLM gateway (used by the memory buffer).
+    """
+    _purpose: str = PrivateAttr()
+
+    def __init__(self, purpose: str = "chat", context_window: int = 4096):
         super().__init__()
-        self._client = client
+        self._purpose = purpose
         self._metadata = type("Metadata", (), {"context_window": context_window})()
 
     @property
@@ -47,17 +39,12 @@ class AzureOpenAIWrapper(LLM):
             {"role": msg.role.value.lower(), "content": msg.content}
             for msg in messages
         ]
-        response = self._client.chat.completions.create(
-            model="gpt-4o",
-            messages=formatted_messages,
-            temperature=kwargs.get("temperature", 0.2),
-            stream=False
+        response = llm_gateway.complete_sync(
+            self._purpose,
+            formatted_messages,
+            temperature=kwargs.get("temperature", 0.2)
         )
-        content = ""
-        for choice in response.choices:
-            delta = choice.delta
-            token = getattr(delta, "content", "")
-            content += token
+        content = response.choices[0].message.content or ""
         result_message = ChatMessage(role=MessageRole.ASSISTANT, content=content)
         return ChatResult(message=result_message)
 
@@ -70,9 +57,9 @@ class AzureOpenAIWrapper(LLM):
             {"role": msg.role.value.lower(), "content": msg.content}
             for msg in messages
         ]
-        response = self._client.chat.completions.create(
-            model="gpt-4o",
-            messages=formatted_messages,
+        response = llm_gateway.complete_sync(
+            self._purpose,
+            formatted_messages,
             temperature=kwargs.get("temperature", 0.2),
             stream=True
         )
@@ -97,22 +84,41 @@ class AzureOpenAIWrapper(LLM):
         return await asyncio.to_thread(self.chat, messages, **kwargs)
 
     async def astream_chat(self, messages: List[ChatMessage], **kwargs) -> AsyncIterator[str]:
-        for token in self.stream_chat(messages, **kwargs):
+        formatted_messages = [
+            {"role": msg.role.value.lower(), "content": msg.content}
+            for msg in messages
+        ]
+        response = await llm_gateway.open_stream(
+            self._purpose,
+            formatted_messages,
+            temperature=kwargs.get("temperature", 0.2)
+        )
+        async for token in response:
             yield token
 
     async def astream_complete(self, prompt: str, **kwargs) -> AsyncIterator[str]:
         async for token in self.astream_chat([ChatMessage(role=MessageRole.USER, content=prompt)], **kwargs):
             yield token
 
-wrapped_client = AzureOpenAIWrapper(client, context_window=4096)
+wrapped_client = AzureOpenAIWrapper("chat", context_window=4096)
 
-session_buffers: Dict[str, ChatSummaryMemoryBuffer] = {}
+def _build_buffer(chat_history: List[ChatMessage]) -> ChatSummaryMemoryBuffer:
+    return ChatSummaryMemoryBuffer.from_defaults(
+        chat_history=chat_history,
+        llm=wrapped_client,
+        token_limit=128000,
+        count_initial_tokens=False
+    )
 
-def get_buffer_for_session(session_id: str) -> ChatSummaryMemoryBuffer:
-    if session_id not in session_buffers:
-        session_buffers[session_id] = ChatSummaryMemoryBuffer.from_defaults(
-            llm=wrapped_client,
-            token_limit=128000,
-            count_initial_tokens=False
-        )
-    return session_buffers[session_id]
+session_memory = SessionMemoryStore(
+    _build_buffer,
+    max_sessions=SESSION_MEMORY_MAX_SESSIONS,
+    idle_ttl=SESSION_MEMORY_IDLE_TTL,
+    max_bytes=SESSION_MEMORY_MAX_BYTES,
+)
+
+def get_buffer_for_session(session_id: str, conversation_history: list) -> ChatSummaryMemoryBuffer:
+    return session_memory.get(session_id, conversation_history)
+
+def record_message(session_id: str, message: ChatMessage) -> None:
+    session_memory.put(session_id, message)
@@ -0,0 +1,54 @@
+import os
+import time
+import asyncio
+from typing import Optional
+from services import repository
+from utils import cache_config
+
+# How long a worker trusts its cached config before re-checking the version in MongoDB.
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "5"))
+
+_refresh_lock = asyncio.Lock()
+
+
+def _store(config_doc: Optional[dict]) -> None:
+    if config_doc is None:
+        cache_config.config_cache = None
+        cache_config.config_version = None
+    else:
+        cache_config.config_version = config_doc.pop("version", 0)
+        cache_config.config_cache = config_doc
+    cache_config.checked_at = time.monotonic()
+
+
+async def get_cached_config() -> Optional[dict]:
+    """
+    Return the config document, shared by every call site of this worker.
+
+    Every CONFIG_CACHE_TTL seconds the worker reads only the `version` field;
+    the full document is reloaded when that version changed, so an admin update
+    made through any worker is picked up by all of them within one TTL.
+    """
+    if cache_config.config_cache is not None and time.monotonic() - cache_config.checked_at < CONFIG_CACHE_TTL:
+        return cache_config.config_cache
+
+    async with _refresh_lock:
+        if cache_config.config_cache is not None and time.monotonic() - cache_config.checked_at < CONFIG_CACHE_TTL:
+            return cache_config.config_cache
+        version_doc = await repository.find_config({"_id": 0, "version": 1})
+        if version_doc is None:
+            _store(None)
+        elif cache_config.config_cache is None or version_doc.get("version", 0) != cache_config.config_version:
+            _store(await repository.find_config({"_id": 0}))
+        else:
+            cache_config.checked_at = time.monotonic()
+        return cache_config.config_cache
+
+
+async def refresh_config_cache() -> Optional[dict]:
+    """
+    Reload the config immediately (used by the worker that performed the update).
+    """
+    async with _refresh_lock:
+        _store(await repository.find_config({"_id": 0}))
+        return cache_config.config_cache
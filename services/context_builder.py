@@ -0,0 +1,97 @@
+import os
+from typing import List, Optional, Tuple
+import tiktoken
+from llama_index.core.base.llms.types import ChatMessage
+from services import repository, llm_gateway
+from utils.prompt_config import get_context_summary_prompt
+
+# Maximum number of prompt tokens sent for a chat turn (system prompt + summary + recent turns).
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "8000"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400"))
+# Per-message framing overhead of the chat format (role, separators).
+MESSAGE_TOKEN_OVERHEAD = 4
+
+_encoding = tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding.encode(text or "", disallowed_special=()))
+
+
+def build_context(
+    system_prompt: str,
+    chat_history: List[ChatMessage],
+    context_summary: Optional[dict] = None,
+    budget: int = CONTEXT_TOKEN_BUDGET,
+) -> Tuple[List[dict], int, int]:
+    """
+    Fit the system prompt, the persisted summary and as many recent turns as
+    possible into `budget` tokens. Turns are added newest first and tokens are
+    only counted for the turns that end up in (or just outside) the window.
+
+    Returns (messages_to_send, first_included_index, prompt_tokens). Turns
+    before `first_included_index` are only represented by the summary.
+    """
+    used = count_tokens(system_prompt) + MESSAGE_TOKEN_OVERHEAD
+    summary_message = None
+    summary_cost = 0
+    if context_summary and context_summary.get("text"):
+        summary_message = {
+            "role": "system",
+            "content": f"Summary of the earlier conversation:\n{context_summary['text']}",
+        }
+        summary_cost = count_tokens(summary_message["content"]) + MESSAGE_TOKEN_OVERHEAD
+        used += summary_cost
+
+    first_included = len(chat_history)
+    for index in range(len(chat_history) - 1, -1, -1):
+        cost = count_tokens(chat_history[index].content) + MESSAGE_TOKEN_OVERHEAD
+        # The latest message is always sent, even if it alone exceeds the budget.
+        if used + cost > budget and index < len(chat_history) - 1:
+            break
+        used += cost
+        first_included = index
+
+    messages_to_send = [{"role": "system", "content": system_prompt}]
+    if summary_message and first_included > 0:
+        messages_to_send.append(summary_message)
+    else:
+        used -= summary_cost
+    messages_to_send += [
+        {"role": msg.role.value.lower(), "content": msg.content}
+        for msg in chat_history[first_included:]
+    ]
+    return messages_to_send, first_included, used
+
+
+def needs_summary(context_summary: Optional[dict], first_included: int) -> bool:
+    covered = (context_summary or {}).get("message_count", 0)
+    return first_included > covered
+
+
+async def refresh_summary(
+    session_id: str,
+    chat_history: List[ChatMessage],
+    context_summary: Optional[dict],
+    upto: int,
+) -> Optional[dict]:
+    """
+    Fold the turns between the current summary and `upto` into the summary and
+    persist it on the chat document, so the next turn reuses it for free.
+    """
+    covered = (context_summary or {}).get("message_count", 0)
+    if upto <= covered:
+        return context_summary
+    dropped = [
+        {"role": msg.role.value.lower(), "content": msg.content}
+        for msg in chat_history[covered:upto]
+    ]
+    prompt = get_context_summary_prompt((context_summary or {}).get("text"), dropped)
+    response = await llm_gateway.complete(
+        "summary",
+        [{"role": "user", "content": prompt}],
+        max_tokens=CONTEXT_SUMMARY_MAX_TOKENS,
+    )
+    summary = {"text": response.choices[0].message.content.strip(), "message_count": upto}
+    await repository.set_context_summary(session_id, summary)
+    return summary
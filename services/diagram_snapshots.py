@@ -0,0 +1,71 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from services import repository
+from services.admin_services import compute_diagram_data
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_NAME = "diagrams"
+# How often each worker checks whether analyses changed since the last snapshot.
+DIAGRAM_REFRESH_INTERVAL = float(os.getenv("DIAGRAM_REFRESH_INTERVAL", "30"))
+# Upper bound of a recomputation; past it another worker may take over the refresh.
+DIAGRAM_REFRESH_LEASE_SECONDS = int(os.getenv("DIAGRAM_REFRESH_LEASE_SECONDS", "300"))
+
+
+async def refresh_diagram_snapshot(force: bool = False) -> bool:
+    """
+    Recompute the diagram payload if analyses changed since the stored snapshot.
+    Returns True when this call produced a new snapshot.
+    """
+    revision = await repository.get_revision("analyses")
+    snapshot = await repository.find_snapshot(SNAPSHOT_NAME)
+    if not force and snapshot and "payload" in snapshot and snapshot.get("revision") == revision:
+        return False
+
+    now = datetime.now(timezone.utc)
+    if not await repository.acquire_snapshot_lease(SNAPSHOT_NAME, now, now + timedelta(seconds=DIAGRAM_REFRESH_LEASE_SECONDS)):
+        return False
+
+    try:
+        payload = await compute_diagram_data()
+    except Exception:
+        await repository.store_snapshot(SNAPSHOT_NAME, {"refreshing_until": now})
+        raise
+    await repository.store_snapshot(SNAPSHOT_NAME, {
+        "payload": payload,
+        "revision": revision,
+        "computed_at": datetime.now(timezone.utc),
+        "refreshing_until": now,
+    })
+    return True
+
+
+async def get_diagram_snapshot() -> dict:
+    """
+    Serve the last materialized /diagrams payload with its freshness timestamp.
+    Only the very first call (no snapshot yet) computes it inline.
+    """
+    snapshot = await repository.find_snapshot(SNAPSHOT_NAME)
+    if not snapshot or "payload" not in snapshot:
+        await refresh_diagram_snapshot(force=True)
+        snapshot = await repository.find_snapshot(SNAPSHOT_NAME) or {}
+    return {
+        **snapshot.get("payload", {}),
+        "computed_at": snapshot.get("computed_at"),
+    }
+
+
+async def run_diagram_refresher():
+    """
+    Background loop started with the app: keeps the snapshot in line with the analyses collection.
+    """
+    while True:
+        try:
+            await refresh_diagram_snapshot()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Diagram snapshot refresh failed")
+        await asyncio.sleep(DIAGRAM_REFRESH_INTERVAL)
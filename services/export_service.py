@@ -0,0 +1,163 @@
+import io
+import csv
+import json
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+from fastapi.responses import StreamingResponse
+from services import repository
+
+EXPORT_MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+EXPORT_BATCH_SIZE = 200
+
+# CSV columns per collection; nested values (histories, analysis details) are written as JSON text.
+CHAT_COLUMNS = ["session_id", "prolific_id", "final_idea", "created_at", "conversation_history"]
+ANALYSIS_COLUMNS = [
+    "session_id", "prolific_id", "final_idea", "created_at",
+    "originality_score", "matching_score", "assistant_influence_score",
+    "time_stats.total_messages", "time_stats.total_duration_minutes",
+    "time_stats.num_gaps_over_30mins", "time_stats.user_returned_after_30mins",
+    "time_stats.avg_ai_latency_seconds",
+    "size_stats.avg_user_size", "size_stats.avg_ai_size",
+    "matching_analysis",
+]
+
+
+def normalize_format(file_format: Optional[str]) -> str:
+    file_format = (file_format or "json").lower()
+    if file_format not in EXPORT_MEDIA_TYPES:
+        raise ValueError(f"Unsupported export format: {file_format}")
+    return file_format
+
+
+def _default(value: Any) -> str:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, default=_default)
+
+
+def _cell(doc: dict, column: str) -> Any:
+    value: Any = doc
+    for key in column.split("."):
+        value = value.get(key) if isinstance(value, dict) else None
+    if isinstance(value, (dict, list)):
+        return _dumps(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return "" if value is None else value
+
+
+def _csv_line(values: List[Any]) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+
+async def _first(cursor) -> Optional[dict]:
+    return await anext(cursor, None)
+
+
+async def _rows(first: Optional[dict], cursor) -> AsyncIterator[dict]:
+    if first is None:
+        return
+    yield first
+    async for doc in cursor:
+        yield doc
+
+
+async def _encode(sources: Dict[str, AsyncIterator[dict]], columns: Dict[str, List[str]], file_format: str, single: bool):
+    """
+    Serialize one or several collections row by row. `single` exports a bare
+    list (JSON array / CSV without a `collection` column).
+    """
+    if file_format == "csv":
+        header = columns[next(iter(columns))] if single else ["collection"] + list(dict.fromkeys(
+            column for cols in columns.values() for column in cols
+        ))
+        yield _csv_line(header)
+        for name, rows in sources.items():
+            async for doc in rows:
+                row = {"collection": name, **{column: _cell(doc, column) for column in columns[name]}}
+                yield _csv_line([row.get(column, "") for column in header])
+        return
+
+    if file_format == "ndjson":
+        for name, rows in sources.items():
+            async for doc in rows:
+                yield _dumps(doc if single else {"collection": name, **doc}) + "\n"
+        return
+
+    if not single:
+        yield "{"
+    for index, (name, rows) in enumerate(sources.items()):
+        if not single:
+            yield ("," if index else "") + _dumps(name) + ":"
+        yield "["
+        separator = ""
+        async for doc in rows:
+            yield separator + _dumps(doc)
+            separator = ","
+        yield "]"
+    if not single:
+        yield "}"
+
+
+def _response(body, file_format: str, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[file_format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{file_format}"'},
+    )
+
+
+async def export_chats(ids: List[str], file_format: Optional[str] = None) -> Optional[StreamingResponse]:
+    """
+    Stream the chats of `ids` with a single $in cursor. Returns None when none exist.
+    """
+    file_format = normalize_format(file_format)
+    cursor = repository.iter_chats({"session_id": {"$in": ids}}, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE)
+    first = await _first(cursor)
+    if first is None:
+        return None
+    body = _encode({"chats": _rows(first, cursor)}, {"chats": CHAT_COLUMNS}, file_format, single=True)
+    return _response(body, file_format, "chats")
+
+
+async def export_analysis(ids: List[str], file_format: Optional[str] = None) -> Optional[StreamingResponse]:
+    """
+    Stream the analyses of `ids` with a single $in cursor. Returns None when none exist.
+    """
+    file_format = normalize_format(file_format)
+    cursor = repository.iter_analyses({"session_id": {"$in": ids}}, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE)
+    first = await _first(cursor)
+    if first is None:
+        return None
+    body = _encode({"analyses": _rows(first, cursor)}, {"analyses": ANALYSIS_COLUMNS}, file_format, single=True)
+    return _response(body, file_format, "analyses")
+
+
+async def export_all(ids: List[str], file_format: Optional[str] = None) -> Optional[StreamingResponse]:
+    """
+    Stream chats then analyses of `ids` in one response. Returns None when neither exists.
+    """
+    file_format = normalize_format(file_format)
+    chat_cursor = repository.iter_chats({"session_id": {"$in": ids}}, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE)
+    analysis_cursor = repository.iter_analyses({"session_id": {"$in": ids}}, {"_id": 0}, batch_size=EXPORT_BATCH_SIZE)
+    first_chat = await _first(chat_cursor)
+    first_analysis = await _first(analysis_cursor)
+    if first_chat is None and first_analysis is None:
+        return None
+    body = _encode(
+        {"chats": _rows(first_chat, chat_cursor), "analyses": _rows(first_analysis, analysis_cursor)},
+        {"chats": CHAT_COLUMNS, "analyses": ANALYSIS_COLUMNS},
+        file_format,
+        single=False,
+    )
+    return _response(body, file_format, "export")
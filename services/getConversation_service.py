@@ -1,13 +1,8 @@
 from services.saveConversation_service import load_conversation
-from utils.cache_config import config_cache
-from services.mongodb_connection import MongoDBManager
-
-db_manager = MongoDBManager()
-
-config_collection = db_manager.get_collection("config")
+from services.config_service import get_cached_config
 
 async def get_conversation(session_id: str) -> list:
-    config_doc = config_collection.find_one()
+    config_doc = await get_cached_config()
     sexe = None
     nbreMessage = 15 
     if config_doc and "messageValue" in config_doc:
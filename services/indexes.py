@@ -0,0 +1,133 @@
+import logging
+from typing import Any, Dict, List
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+# Every index the application relies on, per collection. Applied idempotently at startup.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "chats": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+        IndexModel([("created_at", DESCENDING), ("session_id", DESCENDING)], name="created_at_session_id"),
+        IndexModel([("prolific_id", ASCENDING)], name="prolific_id"),
+        # Completed sessions only: status=completed listing, completed counts, batch selection.
+        IndexModel(
+            [("created_at", DESCENDING), ("session_id", DESCENDING)],
+            partialFilterExpression={"final_idea": {"$exists": True}},
+            name="completed_created_at_session_id",
+        ),
+    ],
+    "analyses": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+        IndexModel([("analysis_hash", ASCENDING)], name="analysis_hash"),
+        IndexModel([("created_at", ASCENDING)], name="created_at"),
+    ],
+    "analysis_jobs": [
+        IndexModel([("session_id", ASCENDING)], unique=True, name="session_id_unique"),
+        IndexModel([("job_id", ASCENDING)], unique=True, name="job_id_unique"),
+    ],
+    "analysis_batches": [
+        IndexModel([("batch_id", ASCENDING)], unique=True, name="batch_id_unique"),
+    ],
+    "stream_buffers": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+        IndexModel([("session_id", ASCENDING), ("client_message_id", ASCENDING)], name="session_id_client_message_id"),
+    ],
+}
+
+# Query shapes issued by the application, checked with explain() by scripts/check_indexes.py.
+# Each entry: (collection, description, find command fields).
+QUERY_SHAPES: List[tuple] = [
+    ("chats", "load/save conversation, final idea, /analyze", {"filter": {"session_id": "s"}}),
+    ("chats", "exports ($in)", {"filter": {"session_id": {"$in": ["s1", "s2"]}}}),
+    ("chats", "session listing", {"filter": {}, "sort": {"created_at": -1, "session_id": -1}, "limit": 51}),
+    ("chats", "session listing, next page", {
+        "filter": {"$or": [
+            {"created_at": {"$lt": {"$date": "2030-01-01T00:00:00Z"}}},
+            {"created_at": {"$date": "2030-01-01T00:00:00Z"}, "session_id": {"$lt": "s"}},
+        ]},
+        "sort": {"created_at": -1, "session_id": -1},
+        "limit": 51,
+    }),
+    ("chats", "session listing by participant", {"filter": {"prolific_id": "p"}}),
+    ("chats", "/datas?status=completed", {
+        "filter": {"final_idea": {"$exists": True}},
+        "sort": {"created_at": -1, "session_id": -1},
+        "limit": 51,
+    }),
+    ("chats", "/datas?status=in_progress", {
+        "filter": {"final_idea": {"$exists": False}},
+        "sort": {"created_at": -1, "session_id": -1},
+        "limit": 51,
+    }),
+    ("chats", "completed sessions (rebuild_rollups count, /analyze/batch)", {"filter": {"final_idea": {"$exists": True}}}),
+    ("chats", "created_at backfill", {"filter": {"created_at": {"$exists": False}}}),
+    ("analyses", "analysis by session", {"filter": {"session_id": "s"}}),
+    ("analyses", "exports ($in)", {"filter": {"session_id": {"$in": ["s1", "s2"]}}}),
+    ("analyses", "analysis cache lookup", {"filter": {"analysis_hash": "h"}}),
+    ("analyses", "date-filtered /analysis (native and legacy string dates)", {"filter": {"$or": [
+        {"created_at": {"$gte": {"$date": "2025-01-01T00:00:00Z"}, "$lte": {"$date": "2030-01-01T00:00:00Z"}}},
+        {"created_at": {"$gte": "2025-01-01T00:00:00", "$lte": "2030-01-01T00:00:00"}},
+    ]}}),
+    # Reads every analysis that has a final idea; flagged as long as it cannot be narrowed.
+    ("analyses", "diagram theme texts", {"filter": {"final_idea": {"$exists": True, "$ne": None}}}),
+    ("analyses", "/analysis/timeseries range", {"filter": {"created_at": {
+        "$type": "date", "$gte": {"$date": "2025-01-01T00:00:00Z"},
+    }}}),
+    ("analysis_jobs", "job status", {"filter": {"job_id": "j"}}),
+    ("analysis_jobs", "job dedup", {"filter": {"session_id": "s"}}),
+    ("analysis_batches", "batch status", {"filter": {"batch_id": "b"}}),
+    ("stream_buffers", "re-sent chat message", {"filter": {
+        "session_id": "s", "client_message_id": "c", "status": {"$ne": "truncated"},
+    }}),
+]
+
+
+def fallback_index_name(name: str) -> str:
+    return f"{name}_fallback"
+
+
+async def ensure_indexes(db) -> None:
+    """
+    Create the declared indexes (a no-op for those that already exist). A unique
+    index that cannot be built because of existing duplicates is replaced by a
+    non-unique index on the same keys, so lookups still avoid collection scans;
+    scripts/dedupe_sessions.py --collection <name> removes the duplicates and restores
+    the unique one (analyses, analysis_jobs and chats).
+    """
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        for model in models:
+            name = model.document["name"]
+            unique = model.document.get("unique", False)
+            if unique and fallback_index_name(name) in existing:
+                logger.warning(
+                    "%s on %s is still a non-unique fallback index (duplicates): run scripts/dedupe_sessions.py --collection %s",
+                    name, collection_name, collection_name,
+                )
+                continue
+            try:
+                await collection.create_indexes([model])
+            except OperationFailure as e:
+                logger.error("Could not create index %s on %s: %s", name, collection_name, e)
+                if unique and e.code == DUPLICATE_KEY:
+                    keys = list(model.document["key"].items())
+                    await collection.create_indexes([IndexModel(keys, name=fallback_index_name(name))])
+                    logger.warning("Created non-unique %s on %s instead", fallback_index_name(name), collection_name)
+
+
+def find_collscans(plan: Any) -> bool:
+    """
+    True if a COLLSCAN stage appears anywhere in an explain() plan tree.
+    """
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(find_collscans(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(find_collscans(value) for value in plan)
+    return False
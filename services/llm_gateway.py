@@ -0,0 +1,380 @@
+import os
+import time
+import random
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+import json
+import httpx
+from dotenv import load_dotenv
+from utils.prompt_config import get_stream_continuation_prompt
+from openai import (
+    AzureOpenAI,
+    AsyncAzureOpenAI,
+    APIError,
+    APIStatusError,
+    RateLimitError,
+)
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+API_KEY = os.getenv("API_KEY")
+API_VERSION = os.getenv("OPENAI_API_VERSION")
+API_BASE = os.getenv("API_BASE")
+
+if not API_KEY or not API_VERSION or not API_BASE:
+    raise ValueError("Les variables d'environnement API_KEY, OPENAI_API_VERSION et API_BASE doivent être définies.")
+
+# Pool HTTP partagé par tous les appels LLM (keep-alive : les connexions TLS sont réutilisées).
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", "60"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+# Délai max entre deux octets reçus ; couvre aussi l'attente du premier token en streaming.
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "60"))
+
+# Retries sur 429 / 5xx / erreurs réseau, avec backoff exponentiel et jitter.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+LLM_RETRY_BASE_DELAY = float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5"))
+LLM_RETRY_MAX_DELAY = float(os.getenv("LLM_RETRY_MAX_DELAY", "20"))
+
+
+def _purpose_settings(purpose: str, model: str, temperature: float, max_tokens: Optional[int] = None) -> Dict[str, Any]:
+    prefix = f"LLM_{purpose.upper()}_"
+    max_tokens = os.getenv(prefix + "MAX_TOKENS", max_tokens)
+    return {
+        # Sur Azure, "model" est le nom du déploiement.
+        "model": os.getenv(prefix + "MODEL", model),
+        "temperature": float(os.getenv(prefix + "TEMPERATURE", temperature)),
+        "max_tokens": int(max_tokens) if max_tokens is not None else None,
+    }
+
+LLM_SETTINGS = {
+    "chat": _purpose_settings("chat", "gpt-4o", 0.3),
+    "analysis": _purpose_settings("analysis", "gpt-4o", 0.0),
+    "keywords": _purpose_settings("keywords", "gpt-4o", 0.3),
+    "summary": _purpose_settings("summary", "gpt-4o", 0.0),
+    "repair": _purpose_settings("repair", "gpt-4o", 0.0, 1500),
+}
+
+# Bascule : un endpoint qui échoue LLM_CIRCUIT_FAILURES fois de suite est écarté LLM_CIRCUIT_COOLDOWN secondes.
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+LLM_CIRCUIT_COOLDOWN = float(os.getenv("LLM_CIRCUIT_COOLDOWN", "30"))
+# Poids des nouvelles mesures dans les moyennes mobiles (latence, taux d'erreur).
+LLM_EWMA_ALPHA = float(os.getenv("LLM_EWMA_ALPHA", "0.2"))
+# Une erreur récente pèse comme autant de fois la latence moyenne.
+LLM_ERROR_PENALTY = float(os.getenv("LLM_ERROR_PENALTY", "4"))
+# Le taux d'erreur diminue de moitié toutes les LLM_ERROR_HALF_LIFE secondes, même sans trafic :
+# un endpoint écarté après une erreur redevient candidat et est ré-évalué.
+LLM_ERROR_HALF_LIFE = float(os.getenv("LLM_ERROR_HALF_LIFE", "30"))
+# Nombre de reprises d'une réponse streamée interrompue, sur un autre endpoint.
+LLM_STREAM_MAX_RESUMES = int(os.getenv("LLM_STREAM_MAX_RESUMES", "1"))
+
+_limits = httpx.Limits(
+    max_connections=LLM_MAX_CONNECTIONS,
+    max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+)
+_timeout = httpx.Timeout(LLM_READ_TIMEOUT, connect=LLM_CONNECT_TIMEOUT)
+
+
+class Endpoint:
+    """
+    One Azure OpenAI resource (region) with its own deployments, keep-alive pools and health.
+    """
+
+    def __init__(self, name: str, api_base: str, api_key: str, api_version: str, deployments: Dict[str, str]):
+        self.name = name
+        self.deployments = deployments
+        # max_retries=0 : les retries sont gérés ici, une seule politique pour tous les appels.
+        self.async_client = AsyncAzureOpenAI(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=api_base,
+            max_retries=0,
+            http_client=httpx.AsyncClient(limits=_limits, timeout=_timeout),
+        )
+        # Seulement pour les chemins synchrones de llama-index (résumé du memory buffer).
+        self.client = AzureOpenAI(
+            api_key=api_key,
+            api_version=api_version,
+            azure_endpoint=api_base,
+            max_retries=0,
+            http_client=httpx.Client(limits=_limits, timeout=_timeout),
+        )
+        # Latency EWMA per purpose: a stream open (time to first byte) and a full
+        # non-streamed analysis differ by orders of magnitude and must not be mixed.
+        self.latency: Dict[str, float] = {}
+        self.error_rate = 0.0
+        self.error_at = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def deployment(self, purpose: str, default: str) -> str:
+        return self.deployments.get(purpose, default)
+
+    def available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def current_error_rate(self, now: float) -> float:
+        # Decays with time as well as with successes: an endpoint nobody picks any more
+        # after a failure would otherwise keep its penalty forever.
+        return self.error_rate * 0.5 ** ((now - self.error_at) / LLM_ERROR_HALF_LIFE)
+
+    def score(self, purpose: str, now: float) -> float:
+        # Unmeasured endpoints score 0, so every endpoint gets probed early on.
+        return self.latency.get(purpose, 0.0) * (1 + LLM_ERROR_PENALTY * self.current_error_rate(now))
+
+    def record_success(self, purpose: str, latency: float) -> None:
+        previous = self.latency.get(purpose)
+        self.latency[purpose] = latency if previous is None else previous + LLM_EWMA_ALPHA * (latency - previous)
+        now = time.monotonic()
+        error_rate = self.current_error_rate(now)
+        self.error_rate, self.error_at = error_rate - LLM_EWMA_ALPHA * error_rate, now
+        self.consecutive_failures = 0
+
+    def record_failure(self, cooldown: Optional[float] = None) -> None:
+        now = time.monotonic()
+        error_rate = self.current_error_rate(now)
+        self.error_rate, self.error_at = error_rate + LLM_EWMA_ALPHA * (1 - error_rate), now
+        self.consecutive_failures += 1
+        if cooldown is None and self.consecutive_failures >= LLM_CIRCUIT_FAILURES:
+            cooldown = LLM_CIRCUIT_COOLDOWN
+        if cooldown:
+            self.open_until = max(self.open_until, now + cooldown)
+            logger.warning("LLM endpoint %s set aside for %.1fs", self.name, cooldown)
+
+
+def _load_endpoints() -> List[Endpoint]:
+    """
+    LLM_ENDPOINTS: JSON list of {"name", "api_base", "api_key"?, "api_version"?, "deployments"?: {purpose: deployment}}.
+    Without it, the single API_BASE endpoint is used.
+    """
+    raw = os.getenv("LLM_ENDPOINTS")
+    configs = json.loads(raw) if raw else [{"name": "default", "api_base": API_BASE}]
+    return [
+        Endpoint(
+            name=config.get("name", config["api_base"]),
+            api_base=config["api_base"],
+            api_key=config.get("api_key", API_KEY),
+            api_version=config.get("api_version", API_VERSION),
+            deployments=config.get("deployments", {}),
+        )
+        for config in configs
+    ]
+
+try:
+    endpoints = _load_endpoints()
+except Exception as e:
+    raise RuntimeError(f"Erreur lors de l'initialisation du client Azure OpenAI : {e}")
+
+
+def _pick_endpoint(purpose: str, exclude: Set[str]) -> Endpoint:
+    """
+    Healthy endpoint with the best latency/error score for `purpose`, not yet tried for this call.
+    When every candidate is set aside, the one that recovers first is used anyway.
+    """
+    candidates = [endpoint for endpoint in endpoints if endpoint.name not in exclude] or endpoints
+    now = time.monotonic()
+    healthy = [endpoint for endpoint in candidates if endpoint.available(now)]
+    if not healthy:
+        return min(candidates, key=lambda endpoint: endpoint.open_until)
+    scores = {endpoint.name: endpoint.score(purpose, now) for endpoint in healthy}
+    best = min(scores.values())
+    return random.choice([endpoint for endpoint in healthy if scores[endpoint.name] == best])
+
+
+def retry_after(error: APIStatusError) -> Optional[float]:
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def _is_endpoint_failure(error: Exception) -> bool:
+    """
+    Errors that say something about the endpoint (throttled, down, unreachable) rather than about the request.
+    """
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, (APIError, httpx.TransportError))
+
+
+def _record_failure(endpoint: Endpoint, error: Exception) -> None:
+    cooldown = retry_after(error) if isinstance(error, RateLimitError) else None
+    endpoint.record_failure(cooldown)
+
+
+def _has_alternative(tried: Set[str]) -> bool:
+    now = time.monotonic()
+    return any(endpoint.name not in tried and endpoint.available(now) for endpoint in endpoints)
+
+
+def _retry_delay(error: Exception, attempt: int, max_retries: int, tried: Set[str]) -> Optional[float]:
+    """
+    Seconds to wait before retrying after `error`, or None if it must not be retried.
+    Another healthy endpoint is tried at once; otherwise a 429 honours the server's
+    Retry-After when present, and anything else gets full-jitter backoff.
+    """
+    if attempt >= max_retries or not _is_endpoint_failure(error):
+        return None
+    if _has_alternative(tried):
+        return 0.0
+    if isinstance(error, RateLimitError):
+        hinted = retry_after(error)
+        if hinted is not None:
+            return min(hinted, LLM_RETRY_MAX_DELAY) + random.uniform(0, LLM_RETRY_BASE_DELAY)
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def _request(purpose: str, messages: List[Dict[str, str]], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    request = {key: value for key, value in LLM_SETTINGS[purpose].items() if value is not None}
+    request.update(overrides)
+    request["messages"] = messages
+    return request
+
+
+async def _create(purpose: str, request: Dict[str, Any], max_retries: int, tried: Set[str]):
+    attempt = 0
+    while True:
+        endpoint = _pick_endpoint(purpose, tried)
+        started = time.monotonic()
+        try:
+            response = await endpoint.async_client.chat.completions.create(
+                **{**request, "model": endpoint.deployment(purpose, request["model"])}
+            )
+        except Exception as e:
+            if _is_endpoint_failure(e):
+                _record_failure(endpoint, e)
+                tried.add(endpoint.name)
+            delay = _retry_delay(e, attempt, max_retries, tried)
+            if delay is None:
+                raise
+            logger.warning("LLM %s call failed on %s (%s), retry %d in %.2fs", purpose, endpoint.name, e, attempt + 1, delay)
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        endpoint.record_success(purpose, time.monotonic() - started)
+        return endpoint, response
+
+
+async def complete(purpose: str, messages: List[Dict[str, str]], max_retries: int = LLM_MAX_RETRIES, **overrides):
+    """
+    Chat completion with the model settings of `purpose` ("chat", "analysis", ...), on the
+    best endpoint available. Keyword arguments override those settings or add request options.
+    """
+    _, response = await _create(purpose, _request(purpose, messages, overrides), max_retries, set())
+    return response
+
+
+class TextStream:
+    """
+    Text tokens of a streamed completion. If the upstream stream breaks midway, the
+    answer is continued on another endpoint from the text already received.
+    """
+
+    def __init__(self, purpose: str, messages: List[Dict[str, str]], max_retries: int, overrides: Dict[str, Any]):
+        self.text = ""
+        self._purpose = purpose
+        self._messages = messages
+        self._max_retries = max_retries
+        self._overrides = {**overrides, "stream": True}
+        self._tried: Set[str] = set()
+        self._endpoint = None
+        self._response = None
+        self._closed = False
+
+    async def _open(self, messages: List[Dict[str, str]]) -> None:
+        request = _request(self._purpose, messages, self._overrides)
+        self._endpoint, self._response = await _create(self._purpose, request, self._max_retries, self._tried)
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._tokens()
+
+    async def aclose(self) -> None:
+        """
+        Abort the generation: closing the HTTP response makes the deployment stop producing tokens.
+        """
+        self._closed = True
+        if self._response is not None:
+            await self._response.close()
+
+    async def _tokens(self) -> AsyncIterator[str]:
+        resumes = 0
+        while True:
+            try:
+                async for chunk in self._response:
+                    if chunk.choices:
+                        token = getattr(chunk.choices[0].delta, "content", "")
+                        if token:
+                            self.text += token
+                            yield token
+                return
+            except Exception as e:
+                if self._closed:
+                    # Aborted on purpose: no failover, no health penalty.
+                    return
+                if not _is_endpoint_failure(e) or resumes >= LLM_STREAM_MAX_RESUMES:
+                    raise
+                _record_failure(self._endpoint, e)
+                self._tried.add(self._endpoint.name)
+                resumes += 1
+                logger.warning("LLM %s stream broke on %s (%s), resuming after %d chars", self._purpose, self._endpoint.name, e, len(self.text))
+            messages = self._messages
+            if self.text:
+                messages = messages + [
+                    {"role": "assistant", "content": self.text},
+                    {"role": "user", "content": get_stream_continuation_prompt()},
+                ]
+            await self._open(messages)
+
+
+async def open_stream(purpose: str, messages: List[Dict[str, str]], max_retries: int = LLM_MAX_RETRIES, **overrides) -> TextStream:
+    """
+    Open a streamed completion (errors before the first token are raised here) and return its text stream.
+    """
+    stream = TextStream(purpose, messages, max_retries, overrides)
+    await stream._open(messages)
+    return stream
+
+
+def complete_sync(purpose: str, messages: List[Dict[str, str]], **overrides):
+    """
+    Blocking variant of `complete`, for synchronous callers only.
+    """
+    request = _request(purpose, messages, overrides)
+    tried: Set[str] = set()
+    attempt = 0
+    while True:
+        endpoint = _pick_endpoint(purpose, tried)
+        started = time.monotonic()
+        try:
+            response = endpoint.client.chat.completions.create(
+                **{**request, "model": endpoint.deployment(purpose, request["model"])}
+            )
+        except Exception as e:
+            if _is_endpoint_failure(e):
+                _record_failure(endpoint, e)
+                tried.add(endpoint.name)
+            delay = _retry_delay(e, attempt, LLM_MAX_RETRIES, tried)
+            if delay is None:
+                raise
+            logger.warning("LLM %s call failed on %s (%s), retry %d in %.2fs", purpose, endpoint.name, e, attempt + 1, delay)
+            attempt += 1
+            time.sleep(delay)
+            continue
+        endpoint.record_success(purpose, time.monotonic() - started)
+        return response
+
+
+async def aclose() -> None:
+    for endpoint in endpoints:
+        await endpoint.async_client.close()
+        endpoint.client.close()
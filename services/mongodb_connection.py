@@ -1,14 +1,29 @@
 from dotenv import load_dotenv
 import os
-from pymongo import MongoClient
+from pymongo import MongoClient, AsyncMongoClient
  
 class MongoDBManager:
     def __init__(self):
         load_dotenv()
         uri = os.getenv('MONGO_URI')
         db_name = os.getenv('MONGO_DB_NAME')
-        self.client = MongoClient(uri)
+        self.client = MongoClient(uri, tz_aware=True)
         self.db = self.client[db_name]
  
     def get_collection(self, collection_name):
-        return self.db[collection_name]
\ No newline at end of file
+        return self.db[collection_name]
+
+class AsyncMongoDBManager:
+    """
+    Same as MongoDBManager but backed by the native asyncio pymongo client,
+    so queries never block the event loop.
+    """
+    def __init__(self):
+        load_dotenv()
+        uri = os.getenv('MONGO_URI')
+        db_name = os.getenv('MONGO_DB_NAME')
+        self.client = AsyncMongoClient(uri, tz_aware=True)
+        self.db = self.client[db_name]
+
+    def get_collection(self, collection_name):
+        return self.db[collection_name]
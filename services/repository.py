@@ -0,0 +1,284 @@
+from utils.time_utils import utc_now
+from typing import Any, Dict, List, Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from services.mongodb_connection import AsyncMongoDBManager
+
+db_manager = AsyncMongoDBManager()
+
+chat_collection = db_manager.get_collection("chats")
+analysis_collection = db_manager.get_collection("analyses")
+config_collection = db_manager.get_collection("config")
+analysis_job_collection = db_manager.get_collection("analysis_jobs")
+analysis_batch_collection = db_manager.get_collection("analysis_batches")
+meta_collection = db_manager.get_collection("meta")
+snapshot_collection = db_manager.get_collection("snapshots")
+rollup_collection = db_manager.get_collection("rollups")
+rate_limit_collection = db_manager.get_collection("rate_limits")
+stream_buffer_collection = db_manager.get_collection("stream_buffers")
+
+
+# --- revisions ---
+
+async def bump_revision(name: str):
+    """
+    Monotonic change counter (e.g. "analyses"), used by materialized views to detect staleness.
+    Bump it after every derived state (rollups) is written, so that a snapshot taken
+    at the new revision can never be built from the old rollup.
+    """
+    return await meta_collection.update_one({"_id": name}, {"$inc": {"revision": 1}}, upsert=True)
+
+async def get_revision(name: str) -> int:
+    doc = await meta_collection.find_one({"_id": name}, {"revision": 1})
+    return doc.get("revision", 0) if doc else 0
+
+
+# --- chats ---
+
+async def find_chat(session_id: str, projection: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+    return await chat_collection.find_one({"session_id": session_id}, projection)
+
+async def find_chats(query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> List[dict]:
+    return await chat_collection.find(query, projection).to_list(None)
+
+def iter_chats(query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None, batch_size: int = 100):
+    """
+    Async cursor over chats, fetched `batch_size` documents at a time.
+    """
+    return chat_collection.find(query, projection, batch_size=batch_size)
+
+async def aggregate_chats(pipeline: List[Dict[str, Any]]) -> List[dict]:
+    cursor = await chat_collection.aggregate(pipeline)
+    return await cursor.to_list(None)
+
+async def count_chats(query: Dict[str, Any]) -> int:
+    return await chat_collection.count_documents(query)
+
+async def update_chat(session_id: str, update: Dict[str, Any], upsert: bool = False):
+    return await chat_collection.update_one({"session_id": session_id}, update, upsert=upsert)
+
+async def append_chat_messages(session_id: str, messages: List[Dict[str, Any]]):
+    """
+    Append-only write: pushes `messages` unless one of their `message_id`s is
+    already stored, so a replayed write is a no-op. Only the new messages go
+    over the wire; the stored history is never read back.
+    """
+    message_ids = [m["message_id"] for m in messages]
+    result = await chat_collection.update_one(
+        {"session_id": session_id, "conversation_history.message_id": {"$nin": message_ids}},
+        {"$push": {"conversation_history": {"$each": messages}}}
+    )
+    if result.matched_count:
+        return result
+    # No document accepted the push: either the session does not exist yet,
+    # or these messages were already written (idempotent replay).
+    return await chat_collection.update_one(
+        {"session_id": session_id},
+        {"$setOnInsert": {
+            "session_id": session_id,
+            "conversation_history": messages,
+            "created_at": utc_now(),
+        }},
+        upsert=True
+    )
+
+async def set_context_summary(session_id: str, summary: Dict[str, Any]):
+    """
+    Stores the rolling context summary, never replacing it with one that covers fewer messages.
+    """
+    return await chat_collection.update_one(
+        {
+            "session_id": session_id,
+            "$or": [
+                {"context_summary.message_count": {"$lt": summary["message_count"]}},
+                {"context_summary": {"$exists": False}},
+            ],
+        },
+        {"$set": {"context_summary": summary}}
+    )
+
+async def set_final_idea(session_id: str, idea: str, prolific_id: str) -> Optional[dict]:
+    """
+    Sets the final idea (creating the chat if needed) and returns the document as it was before.
+    """
+    return await chat_collection.find_one_and_update(
+        {"session_id": session_id},
+        {
+            "$set": {"final_idea": idea, "prolific_id": prolific_id},
+            "$setOnInsert": {"created_at": utc_now()},
+        },
+        projection={"_id": 0, "final_idea": 1, "prolific_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+
+async def backfill_chat_created_at():
+    """
+    Chats created before `created_at` existed get the creation time embedded in their ObjectId.
+    """
+    return await chat_collection.update_many(
+        {"created_at": {"$exists": False}},
+        [{"$set": {"created_at": {"$toDate": "$_id"}}}]
+    )
+
+async def delete_chat(session_id: str) -> Optional[dict]:
+    """
+    Returns the deleted chat (final idea only), or None if there was none.
+    """
+    return await chat_collection.find_one_and_delete({"session_id": session_id}, {"_id": 0, "final_idea": 1})
+
+
+# --- analyses ---
+
+async def find_analysis(session_id: str, projection: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+    return await analysis_collection.find_one({"session_id": session_id}, projection)
+
+def iter_analyses(query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None, batch_size: int = 100):
+    """
+    Async cursor over analyses, fetched `batch_size` documents at a time.
+    """
+    return analysis_collection.find(query, projection, batch_size=batch_size)
+
+async def find_analyses(query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> List[dict]:
+    return await analysis_collection.find(query, projection).to_list(None)
+
+async def aggregate_analyses(pipeline: List[Dict[str, Any]]) -> List[dict]:
+    cursor = await analysis_collection.aggregate(pipeline)
+    return await cursor.to_list(None)
+
+async def find_analysis_by_hash(analysis_hash: str, projection: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+    return await analysis_collection.find_one({"analysis_hash": analysis_hash}, projection)
+
+def analysis_upsert_update(document: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Update writing a (re-)analysis of a session: every field is refreshed except
+    created_at, which keeps the time the session was first analyzed.
+    """
+    values = dict(document)
+    created_at = values.pop("created_at", None) or utc_now()
+    return {"$set": values, "$setOnInsert": {"created_at": created_at}}
+
+async def upsert_analysis(document: Dict[str, Any]) -> Optional[dict]:
+    """
+    One analysis per session: re-analyzing a session updates its document in place.
+    Returns the previous document (None if the session had no analysis yet).
+    """
+    previous = await analysis_collection.find_one_and_update(
+        {"session_id": document["session_id"]}, analysis_upsert_update(document), upsert=True
+    )
+    return previous
+
+async def bulk_write_analyses(operations: List[Any]):
+    return await analysis_collection.bulk_write(operations, ordered=False)
+
+async def delete_analysis(session_id: str) -> Optional[dict]:
+    """
+    Returns the deleted analysis, or None if there was none.
+    """
+    return await analysis_collection.find_one_and_delete({"session_id": session_id})
+
+
+# --- config ---
+
+async def find_config(projection: Optional[Dict[str, Any]] = None) -> Optional[dict]:
+    return await config_collection.find_one({}, projection)
+
+async def upsert_config(values: Dict[str, Any]):
+    """
+    Every write bumps `version` so that workers can detect stale cached copies.
+    """
+    return await config_collection.update_one({}, {"$set": values, "$inc": {"version": 1}}, upsert=True)
+
+
+# --- analysis jobs ---
+
+async def find_analysis_job(query: Dict[str, Any]) -> Optional[dict]:
+    return await analysis_job_collection.find_one(query, {"_id": 0})
+
+async def insert_analysis_job(job: Dict[str, Any]):
+    return await analysis_job_collection.insert_one(dict(job))
+
+async def replace_analysis_job(query: Dict[str, Any], job: Dict[str, Any]) -> Optional[dict]:
+    """
+    Replaces the job matching `query` and returns the previous one (None if nothing matched).
+    """
+    return await analysis_job_collection.find_one_and_replace(query, dict(job))
+
+async def update_analysis_job(job_id: str, values: Dict[str, Any]):
+    return await analysis_job_collection.update_one({"job_id": job_id}, {"$set": values})
+
+
+# --- analysis batches ---
+
+async def insert_analysis_batch(batch: Dict[str, Any]):
+    return await analysis_batch_collection.insert_one(dict(batch))
+
+async def find_analysis_batch(batch_id: str) -> Optional[dict]:
+    return await analysis_batch_collection.find_one({"batch_id": batch_id}, {"_id": 0})
+
+async def update_analysis_batch(batch_id: str, update: Dict[str, Any]):
+    return await analysis_batch_collection.update_one({"batch_id": batch_id}, update)
+
+
+# --- materialized snapshots ---
+
+async def find_snapshot(name: str) -> Optional[dict]:
+    return await snapshot_collection.find_one({"_id": name})
+
+async def acquire_snapshot_lease(name: str, now, lease_until) -> bool:
+    """
+    Take the refresh lease of a snapshot so that only one worker recomputes it at a time.
+    """
+    try:
+        await snapshot_collection.update_one(
+            {"_id": name, "$or": [{"refreshing_until": {"$lt": now}}, {"refreshing_until": {"$exists": False}}]},
+            {"$set": {"refreshing_until": lease_until}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # The document exists and its lease is still held by another worker.
+        return False
+    return True
+
+async def store_snapshot(name: str, values: Dict[str, Any]):
+    return await snapshot_collection.update_one({"_id": name}, {"$set": values}, upsert=True)
+
+
+# --- statistics rollups ---
+
+async def find_rollup(rollup_id: str) -> Optional[dict]:
+    return await rollup_collection.find_one({"_id": rollup_id}, {"_id": 0})
+
+async def update_rollup(rollup_id: str, update: Dict[str, Any], upsert: bool = True):
+    return await rollup_collection.update_one({"_id": rollup_id}, update, upsert=upsert)
+
+
+# --- rate limits ---
+
+async def update_rate_limit(bucket_id: str, pipeline: List[Dict[str, Any]]) -> dict:
+    """
+    Apply an update pipeline to a rate-limit bucket atomically and return the updated bucket.
+    """
+    return await rate_limit_collection.find_one_and_update(
+        {"_id": bucket_id},
+        pipeline,
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+
+# --- stream buffers ---
+
+async def insert_stream_buffer(buffer: Dict[str, Any]):
+    return await stream_buffer_collection.insert_one(buffer)
+
+async def find_stream_buffer(query: Dict[str, Any], projection: Optional[Dict[str, Any]] = None, sort: Optional[List[Any]] = None) -> Optional[dict]:
+    return await stream_buffer_collection.find_one(query, projection, sort=sort)
+
+async def update_stream_buffer(stream_id: str, values: Dict[str, Any]) -> Optional[dict]:
+    return await stream_buffer_collection.find_one_and_update(
+        {"_id": stream_id},
+        {"$set": values},
+        projection={"text": 0},
+        return_document=ReturnDocument.AFTER
+    )
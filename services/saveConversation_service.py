@@ -1,9 +1,6 @@
-import asyncio
-from services.mongodb_connection import MongoDBManager
-
-mongo_manager = MongoDBManager()
-collection = mongo_manager.get_collection('chats')
-config_collection = mongo_manager.get_collection("config")
+import uuid
+from services import repository, stats_rollups
+from services.config_service import get_cached_config
 
 
 async def load_conversation(session_id: str) -> list:
@@ -11,56 +8,48 @@ async def load_conversation(session_id: str) -> list:
     Charge l'historique de conversation pour une session donnée.
     Renvoie une liste de messages (chaque message étant un dict avec 'role' et 'content').
     """
-    def sync_find():
-        doc = collection.find_one({"session_id": session_id})
-        if doc and "conversation_history" in doc:
-            return doc["conversation_history"]
-        return []
-    conversation = await asyncio.to_thread(sync_find)
-    return conversation
+    doc = await repository.find_chat(session_id, {"_id": 0, "conversation_history": 1})
+    if doc and "conversation_history" in doc:
+        return doc["conversation_history"]
+    return []
+
+async def load_session_state(session_id: str):
+    """
+    Charge en un seul aller-retour l'historique et le résumé de contexte persisté de la session.
+    """
+    doc = await repository.find_chat(session_id, {"_id": 0, "conversation_history": 1, "context_summary": 1})
+    if not doc:
+        return [], None
+    return doc.get("conversation_history", []), doc.get("context_summary")
 
 async def update_final_idea(session_id: str, idea: str, prolific_id: str):
     """
     Met à jour ou crée un document pour la session donnée en y ajoutant l'idée finale.
+    Renvoie (modifié, url) : `modifié` est faux si l'idée et le prolific_id étaient déjà enregistrés.
     """
-    def sync_update():
-        return collection.update_one(
-            {"session_id": session_id},
-            {"$set": {"final_idea": idea, "prolific_id": prolific_id
-        }},
-            upsert=True
-        )
-    result = await asyncio.to_thread(sync_update)
-    def sync_get_url():
-        config_doc = config_collection.find_one({}, {"_id": 0, "linkValue": 1})
-        return config_doc.get("linkValue") if config_doc else None
-    
-    url = await asyncio.to_thread(sync_get_url)
-    return result, url
-
-async def save_conversation(session_id: str, conversation_history: list):
+    previous = await repository.set_final_idea(session_id, idea, prolific_id)
+    await stats_rollups.on_final_idea_saved(previous)
+    changed = previous is None or previous.get("final_idea") != idea or previous.get("prolific_id") != prolific_id
+    config_doc = await get_cached_config()
+    url = config_doc.get("linkValue") if config_doc else None
+    return changed, url
+
+def new_message_id() -> str:
     """
-    Ajoute les nouveaux messages sans dupliquer ceux déjà présents dans la base.
+    Clé d'idempotence attribuée à chaque message à sa création.
     """
-    def sync_save():
-        doc = collection.find_one({"session_id": session_id})
-        existing_history = doc.get("conversation_history", []) if doc else []
-
-        existing_set = {f"{m['role']}|{m['content']}|{m['timestamp']}" for m in existing_history}
-        new_filtered = [
-            m for m in conversation_history
-            if f"{m['role']}|{m['content']}|{m['timestamp']}" not in existing_set
-        ]
+    return uuid.uuid4().hex
 
-        combined_history = existing_history + new_filtered
-
-        return collection.update_one(
-            {"session_id": session_id},
-            {"$set": {"conversation_history": combined_history}},
-            upsert=True
-        )
-
-    result = await asyncio.to_thread(sync_save)
+async def save_conversation(session_id: str, new_messages: list):
+    """
+    Ajoute uniquement les nouveaux messages (append-only) à l'historique de la session.
+    Chaque message porte un `message_id` : réécrire un message déjà présent n'a aucun effet.
+    """
+    for message in new_messages:
+        message.setdefault("message_id", new_message_id())
+    if not new_messages:
+        return None
+    result = await repository.append_chat_messages(session_id, new_messages)
+    if result.upserted_id is not None:
+        await stats_rollups.on_chat_created()
     return result
-
-
@@ -0,0 +1,119 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+from llama_index.core.base.llms.types import ChatMessage, MessageRole
+from llama_index.core.memory.chat_summary_memory_buffer import ChatSummaryMemoryBuffer
+
+
+@dataclass
+class _SessionEntry:
+    buffer: ChatSummaryMemoryBuffer
+    synced_count: int
+    size: int
+    last_access: float
+
+
+def _history_to_messages(conversation_history: list) -> List[ChatMessage]:
+    return [
+        ChatMessage(role=MessageRole(msg["role"]), content=msg["content"])
+        for msg in conversation_history
+        if msg.get("role") in ("user", "assistant")
+    ]
+
+
+class SessionMemoryStore:
+    """
+    Cache borné des buffers mémoire par session.
+
+    - LRU : au-delà de `max_sessions` ou de `max_bytes` (taille cumulée des contenus),
+      les sessions les moins récemment utilisées sont évincées.
+    - TTL : une session inactive depuis plus de `idle_ttl` secondes est évincée.
+    - Réhydratation : si le buffer est absent ou ne reflète pas l'historique stocké
+      (session servie par un autre worker entre-temps), il est reconstruit
+      à partir de `conversation_history`.
+    """
+
+    def __init__(
+        self,
+        buffer_factory: Callable[[List[ChatMessage]], ChatSummaryMemoryBuffer],
+        max_sessions: int = 1000,
+        idle_ttl: float = 1800.0,
+        max_bytes: int = 50_000_000,
+    ):
+        self._buffer_factory = buffer_factory
+        self._entries: "OrderedDict[str, _SessionEntry]" = OrderedDict()
+        self._total_size = 0
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def total_size(self) -> int:
+        return self._total_size
+
+    def get(self, session_id: str, conversation_history: list) -> ChatSummaryMemoryBuffer:
+        now = time.monotonic()
+        self._evict_idle(now)
+        entry = self._entries.get(session_id)
+        if entry is None or entry.synced_count != len(conversation_history):
+            entry = self._rehydrate(session_id, conversation_history, now)
+        else:
+            entry.last_access = now
+            self._entries.move_to_end(session_id)
+        self._evict_over_capacity(keep=session_id)
+        return entry.buffer
+
+    def put(self, session_id: str, message: ChatMessage) -> None:
+        """
+        Ajoute un message au buffer de la session s'il est encore en mémoire.
+        Une session évincée sera simplement réhydratée au prochain tour.
+        """
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        entry.buffer.put(message)
+        entry.synced_count += 1
+        added = len(message.content or "")
+        entry.size += added
+        self._total_size += added
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(session_id)
+        self._evict_over_capacity(keep=session_id)
+
+    def discard(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._total_size -= entry.size
+
+    def _rehydrate(self, session_id: str, conversation_history: list, now: float) -> _SessionEntry:
+        self.discard(session_id)
+        messages = _history_to_messages(conversation_history)
+        entry = _SessionEntry(
+            buffer=self._buffer_factory(messages),
+            synced_count=len(conversation_history),
+            size=sum(len(m.content or "") for m in messages),
+            last_access=now,
+        )
+        self._entries[session_id] = entry
+        self._total_size += entry.size
+        return entry
+
+    def _evict_idle(self, now: float) -> None:
+        while self._entries:
+            session_id, entry = next(iter(self._entries.items()))
+            if now - entry.last_access <= self.idle_ttl:
+                break
+            self.discard(session_id)
+
+    def _evict_over_capacity(self, keep: Optional[str] = None) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_sessions or self._total_size > self.max_bytes
+        ):
+            session_id = next(iter(self._entries))
+            if session_id == keep:
+                break
+            self.discard(session_id)
@@ -0,0 +1,181 @@
+"""
+Time, gap, latency and size statistics of chat sessions.
+
+`compute_session_stats` handles one history in a single pass (after one parse
+and, only if needed, one sort) without touching the caller's message dicts.
+`compute_batch_stats` computes the same figures for many sessions at once with
+NumPy, for bulk rescoring. This module has no I/O dependency so it can be used
+from worker processes.
+"""
+from typing import List, Sequence, Tuple
+import numpy as np
+from utils.time_utils import to_utc_datetime
+
+GAP_THRESHOLD_MINUTES = 30
+
+_ROLE_CODES = {"user": 1, "assistant": 2}
+
+EMPTY_TIME_STATS = {
+    "total_messages": 0,
+    "total_duration_minutes": 0.0,
+    "num_gaps_over_30mins": 0,
+    "user_returned_after_30mins": False,
+    "avg_ai_latency_seconds": 0.0
+}
+
+
+def format_duration(seconds):
+    if seconds >= 3600:
+        return f"≈ {round(seconds / 3600, 2)} h"
+    elif seconds >= 60:
+        return f"≈ {round(seconds / 60, 2)} min"
+    else:
+        return f"≈ {round(seconds, 2)} sec"
+
+
+def _finalize(total_messages, total_active, num_gaps, latency_sum, latency_count, user_size_sum, user_count, ai_size_sum, ai_count):
+    if total_messages == 0:
+        time_stats = dict(EMPTY_TIME_STATS)
+    else:
+        time_stats = {
+            "total_messages": int(total_messages),
+            "total_duration_minutes": round(float(total_active), 2),
+            "num_gaps_over_30mins": int(num_gaps),
+            "user_returned_after_30mins": bool(num_gaps > 0),
+            "avg_ai_latency_seconds": format_duration(latency_sum / latency_count) if latency_count else "N/A"
+        }
+    size_stats = {
+        "avg_user_size": user_size_sum / user_count if user_count else 0,
+        "avg_ai_size": ai_size_sum / ai_count if ai_count else 0
+    }
+    return time_stats, size_stats
+
+
+def _parse(conversation_history) -> Tuple[list, bool]:
+    """
+    (timestamp, role, size) rows in stored order, and whether they are already chronological.
+    """
+    rows = []
+    in_order = True
+    previous = None
+    for msg in conversation_history:
+        ts = to_utc_datetime(msg["timestamp"]).timestamp()
+        if previous is not None and ts < previous:
+            in_order = False
+        previous = ts
+        rows.append((ts, msg["role"], msg.get("size", len(msg["content"]))))
+    return rows, in_order
+
+
+def compute_session_stats(conversation_history) -> Tuple[dict, dict]:
+    """
+    Return (time_stats, size_stats) of one session.
+
+    - active duration: sum of gaps between consecutive messages of at most 30 min;
+      longer gaps are counted in num_gaps_over_30mins instead.
+    - AI latency: for every user message but the first, time since the closest
+      preceding assistant message (positive deltas only).
+    - sizes: mean `size` (or content length) of user and assistant messages.
+    """
+    rows, in_order = _parse(conversation_history)
+    if not in_order:
+        rows.sort(key=lambda row: row[0])
+
+    total_active = 0.0
+    num_gaps = 0
+    latency_sum = 0.0
+    latency_count = 0
+    user_messages = 0
+    user_size_sum = 0
+    ai_size_sum = 0
+    ai_messages = 0
+    previous_ts = None
+    last_assistant_ts = None
+
+    for ts, role, size in rows:
+        if previous_ts is not None:
+            delta_min = (ts - previous_ts) / 60.0
+            if delta_min > GAP_THRESHOLD_MINUTES:
+                num_gaps += 1
+            else:
+                total_active += delta_min
+        previous_ts = ts
+
+        if role == "user":
+            user_messages += 1
+            user_size_sum += size
+            if user_messages > 1 and last_assistant_ts is not None:
+                delta = ts - last_assistant_ts
+                if delta > 0:
+                    latency_sum += delta
+                    latency_count += 1
+        elif role == "assistant":
+            ai_messages += 1
+            ai_size_sum += size
+            last_assistant_ts = ts
+
+    return _finalize(len(rows), total_active, num_gaps, latency_sum, latency_count,
+                     user_size_sum, user_messages, ai_size_sum, ai_messages)
+
+
+def compute_batch_stats(histories: Sequence[list]) -> List[Tuple[dict, dict]]:
+    """
+    Vectorized `compute_session_stats` over many sessions: every message of every
+    session is laid out in flat arrays, sorted by (session, time), and each
+    statistic is reduced per session with bincount.
+    """
+    n_sessions = len(histories)
+    lengths = np.fromiter((len(h) for h in histories), dtype=np.int64, count=n_sessions)
+    n_messages = int(lengths.sum())
+    if n_messages == 0:
+        return [_finalize(0, 0, 0, 0, 0, 0, 0, 0, 0) for _ in range(n_sessions)]
+
+    times = np.empty(n_messages, dtype=np.float64)
+    roles = np.empty(n_messages, dtype=np.int8)
+    sizes = np.empty(n_messages, dtype=np.float64)
+    position = 0
+    for history in histories:
+        for msg in history:
+            times[position] = to_utc_datetime(msg["timestamp"]).timestamp()
+            roles[position] = _ROLE_CODES.get(msg["role"], 0)
+            sizes[position] = msg.get("size", len(msg["content"]))
+            position += 1
+    session = np.repeat(np.arange(n_sessions), lengths)
+
+    # Stable sort: ties keep their stored order, like sorted() in the single-session path.
+    order = np.lexsort((times, session))
+    times, roles, sizes = times[order], roles[order], sizes[order]
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    # Gaps between consecutive messages of the same session.
+    same_session = session[1:] == session[:-1]
+    delta_min = np.diff(times) / 60.0
+    is_gap = same_session & (delta_min > GAP_THRESHOLD_MINUTES)
+    is_active = same_session & ~(delta_min > GAP_THRESHOLD_MINUTES)
+    pair_session = session[1:]
+    num_gaps = np.bincount(pair_session[is_gap], minlength=n_sessions)
+    total_active = np.bincount(pair_session[is_active], weights=delta_min[is_active], minlength=n_sessions)
+
+    # Latency: index of the closest preceding assistant message, if in the same session.
+    is_user = roles == 1
+    is_assistant = roles == 2
+    index = np.arange(n_messages)
+    last_assistant = np.maximum.accumulate(np.where(is_assistant, index, -1))
+    user_rank = np.cumsum(is_user)
+    user_rank = user_rank - np.concatenate(([0], user_rank))[starts][session]
+    has_previous = last_assistant >= starts[session]
+    latency = times - times[np.maximum(last_assistant, 0)]
+    counted = is_user & (user_rank > 1) & has_previous & (latency > 0)
+    latency_sum = np.bincount(session[counted], weights=latency[counted], minlength=n_sessions)
+    latency_count = np.bincount(session[counted], minlength=n_sessions)
+
+    user_count = np.bincount(session[is_user], minlength=n_sessions)
+    user_size_sum = np.bincount(session[is_user], weights=sizes[is_user], minlength=n_sessions)
+    ai_count = np.bincount(session[is_assistant], minlength=n_sessions)
+    ai_size_sum = np.bincount(session[is_assistant], weights=sizes[is_assistant], minlength=n_sessions)
+
+    return [
+        _finalize(lengths[i], total_active[i], num_gaps[i], latency_sum[i], latency_count[i],
+                  user_size_sum[i], user_count[i], ai_size_sum[i], ai_count[i])
+        for i in range(n_sessions)
+    ]
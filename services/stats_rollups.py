@@ -0,0 +1,190 @@
+from typing import Any, Dict, Optional
+from services import repository
+
+ROLLUP_ID = "global"
+HEATMAP_BUCKETS = ["0-25", "25-50", "50-75", "75-100", "Unknown"]
+
+# Averaged analysis fields: rollup key -> dotted path in the analysis document.
+AVERAGED_FIELDS = {
+    "ai_score": "assistant_influence_score",
+    "originality": "originality_score",
+    "matching": "matching_score",
+    "duration": "time_stats.total_duration_minutes",
+    "user_msg_size": "size_stats.avg_user_size",
+    "ai_msg_size": "size_stats.avg_ai_size",
+}
+
+
+def _get_path(doc: dict, path: str) -> Any:
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+def _number(value: Any) -> Optional[float]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def originality_bucket(score: Any) -> str:
+    """
+    Same buckets as the former $switch heatmap stage (a missing score sorts before numbers in BSON).
+    """
+    if score is None:
+        return "0-25"
+    score = _number(score)
+    if score is None:
+        return "Unknown"
+    if score < 25:
+        return "0-25"
+    if score < 50:
+        return "25-50"
+    if score < 75:
+        return "50-75"
+    if score <= 100:
+        return "75-100"
+    return "Unknown"
+
+
+def analysis_deltas(doc: Optional[dict], sign: int = 1) -> Dict[str, float]:
+    """
+    $inc document describing what one analysis contributes to the rollup
+    (sign=-1 to withdraw it). Like $avg, non-numeric values are not counted.
+    """
+    if not doc:
+        return {}
+    deltas: Dict[str, float] = {"analyses": sign}
+    for key, path in AVERAGED_FIELDS.items():
+        value = _number(_get_path(doc, path))
+        if value is not None:
+            deltas[f"{key}_sum"] = sign * value
+            deltas[f"{key}_count"] = sign
+    if _get_path(doc, "time_stats.user_returned_after_30mins") is True:
+        deltas["reengagements"] = sign
+
+    bucket = originality_bucket(doc.get("originality_score"))
+    deltas[f"heatmap.{bucket}.count"] = sign
+    total_messages = _number(_get_path(doc, "time_stats.total_messages"))
+    if total_messages is not None:
+        deltas[f"heatmap.{bucket}.messages_sum"] = sign * total_messages
+        deltas[f"heatmap.{bucket}.messages_count"] = sign
+    return deltas
+
+
+async def _increment(deltas: Dict[str, float]):
+    if deltas:
+        await repository.update_rollup(ROLLUP_ID, {"$inc": deltas})
+
+
+async def on_analysis_written(previous: Optional[dict], current: dict):
+    deltas = analysis_deltas(current, 1)
+    for key, value in analysis_deltas(previous, -1).items():
+        deltas[key] = deltas.get(key, 0) + value
+    await _increment({k: v for k, v in deltas.items() if v})
+
+
+async def on_analysis_deleted(previous: Optional[dict]):
+    await _increment(analysis_deltas(previous, -1))
+
+
+async def on_chat_created():
+    await _increment({"total_chats": 1})
+
+
+async def on_final_idea_saved(previous_chat: Optional[dict]):
+    """
+    `previous_chat` is the chat document before the update (None if it was just created).
+    """
+    deltas = {}
+    if previous_chat is None:
+        deltas["total_chats"] = 1
+    if previous_chat is None or "final_idea" not in previous_chat:
+        deltas["completed_sessions"] = 1
+    await _increment(deltas)
+
+
+async def on_chat_deleted(previous_chat: Optional[dict]):
+    if previous_chat is None:
+        return
+    deltas = {"total_chats": -1}
+    if "final_idea" in previous_chat:
+        deltas["completed_sessions"] = -1
+    await _increment(deltas)
+
+
+def _sum_if_number(path: str) -> dict:
+    return {"$sum": {"$cond": [{"$isNumber": f"${path}"}, f"${path}", 0]}}
+
+
+def _count_if_number(path: str) -> dict:
+    return {"$sum": {"$cond": [{"$isNumber": f"${path}"}, 1, 0]}}
+
+
+async def rebuild_rollups() -> dict:
+    """
+    Recompute the rollup from scratch with full scans. Used to initialize it and
+    after bulk rewrites of analyses; regular writes only $inc it.
+    """
+    group: Dict[str, Any] = {
+        "_id": None,
+        "analyses": {"$sum": 1},
+        "reengagements": {"$sum": {"$cond": [{"$eq": ["$time_stats.user_returned_after_30mins", True]}, 1, 0]}},
+    }
+    for key, path in AVERAGED_FIELDS.items():
+        group[f"{key}_sum"] = _sum_if_number(path)
+        group[f"{key}_count"] = _count_if_number(path)
+    totals = await repository.aggregate_analyses([{"$group": group}])
+    rollup = totals[0] if totals else {"analyses": 0, "reengagements": 0}
+    rollup.pop("_id", None)
+
+    heatmap_rows = await repository.aggregate_analyses([
+        {
+            "$group": {
+                "_id": {
+                    "$switch": {
+                        "branches": [
+                            {"case": {"$lt": ["$originality_score", 25]}, "then": "0-25"},
+                            {"case": {"$lt": ["$originality_score", 50]}, "then": "25-50"},
+                            {"case": {"$lt": ["$originality_score", 75]}, "then": "50-75"},
+                            {"case": {"$lte": ["$originality_score", 100]}, "then": "75-100"}
+                        ],
+                        "default": "Unknown"
+                    }
+                },
+                "count": {"$sum": 1},
+                "messages_sum": _sum_if_number("time_stats.total_messages"),
+                "messages_count": _count_if_number("time_stats.total_messages"),
+            }
+        }
+    ])
+    rollup["heatmap"] = {row.pop("_id"): row for row in heatmap_rows}
+    rollup["total_chats"] = await repository.count_chats({})
+    rollup["completed_sessions"] = await repository.count_chats({"final_idea": {"$exists": True}})
+
+    await repository.update_rollup(ROLLUP_ID, {"$set": rollup}, upsert=True)
+    return rollup
+
+
+async def get_rollup() -> dict:
+    rollup = await repository.find_rollup(ROLLUP_ID)
+    if rollup is None or "analyses" not in rollup:
+        rollup = await rebuild_rollups()
+    return rollup
+
+
+def average(rollup: dict, key: str) -> float:
+    count = rollup.get(f"{key}_count", 0)
+    return round(rollup.get(f"{key}_sum", 0) / count, 2) if count else 0.00
+
+
+def heatmap_data(rollup: dict) -> list:
+    rows = []
+    for bucket, values in sorted((rollup.get("heatmap") or {}).items()):
+        if not values.get("count"):
+            continue
+        count = values.get("messages_count", 0)
+        rows.append({"_id": bucket, "avg_messages": values.get("messages_sum", 0) / count if count else None})
+    return rows
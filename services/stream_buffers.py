@@ -0,0 +1,222 @@
+import os
+import time
+import uuid
+import asyncio
+import logging
+from datetime import timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+from services import repository
+from utils.background import spawn
+from utils.time_utils import utc_now
+
+logger = logging.getLogger(__name__)
+
+STREAM_ID_HEADER = "X-Stream-Id"
+# How long a finished (or abandoned) buffer stays resumable; Mongo's TTL index drops it afterwards.
+STREAM_BUFFER_TTL = int(os.getenv("STREAM_BUFFER_TTL", "600"))
+# Generation keeps going this long without any reader, waiting for the client to reconnect;
+# past it the upstream completion is aborted (checked on a timer, not per token).
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "5"))
+# How often the text produced so far is copied to Mongo, for readers on other workers.
+STREAM_BUFFER_FLUSH_INTERVAL = float(os.getenv("STREAM_BUFFER_FLUSH_INTERVAL", "0.5"))
+STREAM_POLL_INTERVAL = float(os.getenv("STREAM_POLL_INTERVAL", "0.25"))
+# A "streaming" buffer not updated for this long belongs to a worker that died.
+STREAM_BUFFER_STALE_SECONDS = float(os.getenv("STREAM_BUFFER_STALE_SECONDS", "90"))
+
+
+class _LiveStream:
+    """
+    Answer being generated by this worker, shared by every reader of the stream.
+    """
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.text = ""
+        self.done = False
+        self.readers = 0
+        self.abandoned = False
+        self.detached_at = time.monotonic()
+        self.changed = asyncio.Condition()
+
+
+# Streams produced by this worker, by stream id.
+_live: Dict[str, _LiveStream] = {}
+
+
+def new_stream_id() -> str:
+    return uuid.uuid4().hex
+
+
+def _expires_at():
+    return utc_now() + timedelta(seconds=STREAM_BUFFER_TTL)
+
+
+async def start(
+    stream_id: str,
+    session_id: str,
+    client_message_id: Optional[str],
+    tokens: AsyncIterator[str],
+    abort: Callable[[], Awaitable[None]],
+    on_finish: Callable[[str, bool], Awaitable[None]],
+) -> None:
+    """
+    Produce the answer in a background task, decoupled from the HTTP response:
+    a dropped connection does not stop it, and readers (re)attach with `follow`.
+    `abort` stops the upstream generation; `on_finish(text, truncated)` persists the answer.
+    """
+    await repository.insert_stream_buffer({
+        "_id": stream_id,
+        "session_id": session_id,
+        "client_message_id": client_message_id,
+        "text": "",
+        "length": 0,
+        "status": "streaming",
+        "updated_at": utc_now(),
+        "expires_at": _expires_at(),
+    })
+    live = _LiveStream(session_id)
+    _live[stream_id] = live
+    spawn(_produce(stream_id, live, tokens, abort, on_finish))
+
+
+async def _flush(stream_id: str, live: _LiveStream, status: str = "streaming") -> None:
+    now = utc_now()
+    buffer = await repository.update_stream_buffer(stream_id, {
+        "text": live.text,
+        "length": len(live.text),
+        "status": status,
+        "updated_at": now,
+        "expires_at": _expires_at(),
+    })
+    # A reader on another worker counts as attached.
+    reader_at = (buffer or {}).get("reader_at")
+    if reader_at and (now - reader_at).total_seconds() < STREAM_RESUME_GRACE:
+        live.detached_at = time.monotonic()
+
+
+async def _watch_readers(stream_id: str, live: _LiveStream, abort: Callable[[], Awaitable[None]]) -> None:
+    while not live.done:
+        await asyncio.sleep(min(1.0, STREAM_RESUME_GRACE))
+        if live.readers == 0 and time.monotonic() - live.detached_at > STREAM_RESUME_GRACE:
+            logger.info("Stream %s abandoned after %d chars", stream_id, len(live.text))
+            live.abandoned = True
+            # Nobody is listening any more: stop paying for tokens.
+            await abort()
+            return
+
+
+async def _produce(stream_id, live, tokens, abort, on_finish) -> None:
+    completed = False
+    last_flush = time.monotonic()
+    watcher = asyncio.create_task(_watch_readers(stream_id, live, abort))
+    try:
+        async for token in tokens:
+            async with live.changed:
+                live.text += token
+                live.changed.notify_all()
+            now = time.monotonic()
+            if now - last_flush >= STREAM_BUFFER_FLUSH_INTERVAL:
+                await _flush(stream_id, live)
+                last_flush = now
+        completed = not live.abandoned
+    except Exception:
+        if not live.abandoned:
+            logger.exception("Stream %s failed after %d chars", stream_id, len(live.text))
+
+    try:
+        watcher.cancel()
+        if not completed and not live.abandoned:
+            # Upstream failed: make sure the connection is released.
+            try:
+                await abort()
+            except Exception:
+                logger.exception("Could not abort stream %s", stream_id)
+        await on_finish(live.text, not completed)
+    finally:
+        async with live.changed:
+            live.done = True
+            live.changed.notify_all()
+        try:
+            await _flush(stream_id, live, "done" if completed else "truncated")
+        finally:
+            _live.pop(stream_id, None)
+
+
+async def find_stream(stream_id: str, session_id: str) -> bool:
+    """
+    True if `stream_id` is a (still resumable) stream of `session_id`.
+    """
+    live = _live.get(stream_id)
+    if live is not None:
+        return live.session_id == session_id
+    return await repository.find_stream_buffer({"_id": stream_id, "session_id": session_id}, {"_id": 1}) is not None
+
+
+async def find_resent(session_id: str, client_message_id: Optional[str]) -> Optional[str]:
+    """
+    Id of the stream already answering the client message `client_message_id`
+    (X-Client-Message-Id), i.e. the client is sending the same message again after
+    a dropped connection. Without that key a message is always a new turn.
+    Truncated answers are never replayed: the re-send gets a fresh generation.
+    """
+    if not client_message_id:
+        return None
+    buffer = await repository.find_stream_buffer(
+        {"session_id": session_id, "client_message_id": client_message_id, "status": {"$ne": "truncated"}},
+        {"_id": 1, "status": 1, "updated_at": 1}
+    )
+    if buffer is None:
+        return None
+    if buffer["status"] == "streaming" and (utc_now() - buffer["updated_at"]).total_seconds() > STREAM_BUFFER_STALE_SECONDS:
+        return None
+    return buffer["_id"]
+
+
+async def follow(stream_id: str, offset: int = 0) -> AsyncIterator[str]:
+    """
+    The answer text from character `offset` onwards, live until generation ends.
+    """
+    live = _live.get(stream_id)
+    if live is not None:
+        async for piece in _follow_live(live, offset):
+            yield piece
+    else:
+        async for piece in _follow_stored(stream_id, offset):
+            yield piece
+
+
+async def _follow_live(live: _LiveStream, offset: int) -> AsyncIterator[str]:
+    live.readers += 1
+    try:
+        while True:
+            async with live.changed:
+                await live.changed.wait_for(lambda: len(live.text) > offset or live.done)
+                piece = live.text[offset:]
+            if piece:
+                offset += len(piece)
+                yield piece
+            elif live.done:
+                return
+    finally:
+        live.readers -= 1
+        if live.readers == 0:
+            live.detached_at = time.monotonic()
+
+
+async def _follow_stored(stream_id: str, offset: int) -> AsyncIterator[str]:
+    # The stream is produced by another worker (or is finished): poll its Mongo copy.
+    while True:
+        buffer = await repository.update_stream_buffer(stream_id, {"reader_at": utc_now()})
+        if buffer is None:
+            return
+        if offset < buffer.get("length", 0) or buffer["status"] != "streaming":
+            stored = await repository.find_stream_buffer({"_id": stream_id}, {"text": 1}) or {}
+            text = stored.get("text", "")
+            if len(text) > offset:
+                yield text[offset:]
+                offset = len(text)
+        if buffer["status"] != "streaming":
+            return
+        if (utc_now() - buffer["updated_at"]).total_seconds() > STREAM_BUFFER_STALE_SECONDS:
+            return
+        await asyncio.sleep(STREAM_POLL_INTERVAL)
@@ -0,0 +1,75 @@
+import os
+import copy
+from typing import Any, Dict, List, Type, TypeVar
+from pydantic import BaseModel, ValidationError
+from utils.prompt_config import get_structured_output_repair_prompt
+from services import llm_gateway
+
+# Repair calls allowed after the first reply fails validation, before giving up.
+STRUCTURED_OUTPUT_REPAIR_ATTEMPTS = int(os.getenv("STRUCTURED_OUTPUT_REPAIR_ATTEMPTS", "1"))
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    """
+    The model reply could not be validated against the expected schema, even after repair.
+    """
+
+
+def _strict(schema: Any) -> Any:
+    # Strict structured outputs require closed objects with every property listed as required.
+    if isinstance(schema, dict):
+        schema = {key: _strict(value) for key, value in schema.items()}
+        if schema.get("type") == "object" and "properties" in schema:
+            schema["additionalProperties"] = False
+            schema["required"] = list(schema["properties"])
+        return schema
+    if isinstance(schema, list):
+        return [_strict(value) for value in schema]
+    return schema
+
+
+def json_schema_format(output_model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    `response_format` asking the model for JSON that follows `output_model`'s schema.
+    """
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": output_model.__name__,
+            "schema": _strict(copy.deepcopy(output_model.model_json_schema())),
+            "strict": True,
+        },
+    }
+
+
+async def request_structured(
+    purpose: str,
+    messages: List[Dict[str, str]],
+    output_model: Type[T],
+    repair_attempts: int = STRUCTURED_OUTPUT_REPAIR_ATTEMPTS,
+) -> T:
+    """
+    Ask for a schema-constrained reply (model settings of `purpose`) and validate it with `output_model`.
+
+    If the reply does not validate, the (short) reply and the validation errors
+    are sent back for repair, at most `repair_attempts` times, instead of rerunning
+    the original, expensive request. Raises StructuredOutputError when it still fails.
+    """
+    response_format = json_schema_format(output_model)
+    response = await llm_gateway.complete(purpose, messages, response_format=response_format)
+    raw_response = response.choices[0].message.content or ""
+
+    for attempt in range(repair_attempts + 1):
+        try:
+            return output_model.model_validate_json(raw_response)
+        except ValidationError as e:
+            if attempt == repair_attempts:
+                raise StructuredOutputError(f"Invalid {output_model.__name__} reply: {e}") from e
+            repair = await llm_gateway.complete(
+                "repair",
+                [{"role": "user", "content": get_structured_output_repair_prompt(raw_response, e)}],
+                response_format=response_format,
+            )
+            raw_response = repair.choices[0].message.content or ""
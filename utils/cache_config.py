@@ -1,3 +1,7 @@
 from typing import Any
 
+# Config document cached by this worker, the version it was read at, and the
+# (monotonic) time its freshness was last checked against MongoDB.
 config_cache: Any = None
+config_version: Any = None
+checked_at: float = 0.0
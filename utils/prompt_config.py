@@ -117,15 +117,18 @@ def get_keyword_extraction_prompt(texts):
     Analyze the following texts and extract the **most frequent themes or concepts**.
     - Group similar words (e.g., "AI" and "Artificial Intelligence" should be combined).
     - Compute the relative frequency of each theme.
-    - Return ONLY a **Python dictionary** in the following format:
+    - Return ONLY a **JSON object** in the following format:
 
     Expected response (example):
-    {{'science fiction': 0.25, 'adventure': 0.2, 'technology': 0.15, 'space': 0.1, 'AI': 0.3}}
+    {{"themes": [{{"theme": "science fiction", "frequency": 0.25}}, {{"theme": "adventure", "frequency": 0.2}}, {{"theme": "technology", "frequency": 0.15}}, {{"theme": "space", "frequency": 0.1}}, {{"theme": "AI", "frequency": 0.3}}]}}
 
     Texts:
     \"\"\"{" ".join(texts)}\"\"\"
     """
 
+# Bump whenever get_analysis_prompt changes: it is part of the analysis cache key.
+ANALYSIS_PROMPT_VERSION = "2"
+
 def get_analysis_prompt(conversation_history, final_idea):
     """
     Génère le prompt pour analyser l'originalité, l'influence de l'assistant et le matching de l'idée finale avec la conversation.
@@ -188,19 +191,67 @@ def get_analysis_prompt(conversation_history, final_idea):
             - 100.00 = The assistant fully created the idea, and the user only approved.
 
     **IMPORTANT:**
-    - Return ONLY a valid **Python dictionary** (NOT JSON).
+    - Return ONLY a valid **JSON object**.
     - Do NOT include explanations or extra text before/after.
     - The **originality_score** and **assistant_influence_score** are **independent**: they are both out of 100 and do **not** need to sum to 100.
     - The structure MUST be:
         {{
-            'originality_score': <float between 0.00 and 100.00>,
-            'matching_score': <float between 0.00 and 100.00>,
-            'assistant_influence_score': <float between 0.00 and 100.00>,
-            'analysis_details': {{
-                'role_analysis': <One well-developed paragraph explaining how much the user or assistant contributed to idea creation>,
-                'influence': <One detailed paragraph on the assistant’s influence on the content, structure, or logic of the idea>,
-                'original_elements': <One paragraph explaining the parts of the idea that are original and clearly come from the user>,
-                'overall_assessment': <One paragraph summarizing the balance of originality, influence, and matching with the conversation>
+            "originality_score": <float between 0.00 and 100.00>,
+            "matching_score": <float between 0.00 and 100.00>,
+            "assistant_influence_score": <float between 0.00 and 100.00>,
+            "analysis_details": {{
+                "role_analysis": <One well-developed paragraph explaining how much the user or assistant contributed to idea creation>,
+                "influence": <One detailed paragraph on the assistant’s influence on the content, structure, or logic of the idea>,
+                "original_elements": <One paragraph explaining the parts of the idea that are original and clearly come from the user>,
+                "overall_assessment": <One paragraph summarizing the balance of originality, influence, and matching with the conversation>
             }}
         }}
     """
+
+def get_context_summary_prompt(previous_summary, messages):
+    """
+    Génère le prompt pour condenser les anciens tours d'une conversation en un résumé réutilisable.
+    """
+    transcript = "\n".join(
+        f"{msg['role'].capitalize()}: {msg['content']}" for msg in messages
+    )
+
+    return f"""
+    You maintain a running summary of a conversation between a user and an AI assistant.
+    Update the summary so that it also covers the new messages below.
+    - Keep every fact, constraint, idea and decision the user expressed, and the key suggestions of the assistant.
+    - Drop greetings, repetitions and formatting.
+    - Write in the language of the conversation, as a compact paragraph of at most 200 words.
+    - Return ONLY the updated summary text.
+
+    Current summary:
+    \"\"\"{previous_summary or ""}\"\"\"
+
+    New messages:
+    \"\"\"{transcript}\"\"\"
+    """
+
+def get_structured_output_repair_prompt(raw_response, errors):
+    """
+    Génère le prompt de réparation d'une réponse structurée qui ne respecte pas le schéma.
+    """
+    return f"""
+    The following reply was supposed to be a JSON object matching the provided schema, but it failed validation.
+    Fix it so that it matches the schema exactly. Keep the original values and wording wherever they are valid.
+    Return ONLY the corrected JSON object.
+
+    Validation errors:
+    {errors}
+
+    Reply to fix:
+    \"\"\"{raw_response}\"\"\"
+    """
+
+def get_stream_continuation_prompt():
+    """
+    Génère l'instruction de reprise d'une réponse interrompue (bascule vers un autre déploiement).
+    """
+    return (
+        "Your previous reply was cut off. Continue it exactly where it stopped, "
+        "without repeating anything already written and without any preamble."
+    )
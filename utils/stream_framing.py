@@ -0,0 +1,93 @@
+import os
+import asyncio
+from typing import AsyncIterator, Optional
+
+# Tokens are grouped into one write per window, or sooner once the group reaches STREAM_FLUSH_BYTES.
+STREAM_FLUSH_WINDOW = float(os.getenv("STREAM_FLUSH_WINDOW_MS", "30")) / 1000
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "64"))
+# SSE comment sent on an idle stream so that proxies do not close it.
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+
+SSE_MEDIA_TYPE = "text/event-stream"
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+async def coalesce(
+    pieces: AsyncIterator[str],
+    window: float = STREAM_FLUSH_WINDOW,
+    max_bytes: int = STREAM_FLUSH_BYTES,
+    idle: Optional[float] = None,
+) -> AsyncIterator[str]:
+    """
+    Regroupe les petits morceaux de texte : un morceau est émis au plus `window` secondes
+    après le premier texte en attente, ou dès qu'il atteint `max_bytes` octets.
+    Si `idle` est donné, une chaîne vide est émise après `idle` secondes sans rien émettre.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = pieces.__aiter__()
+    # The pending read is kept across timeouts: cancelling it would close the source.
+    pending = None
+    buffer = ""
+    flush_at = 0.0
+    last_emit = loop.time()
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if buffer:
+                timeout = max(0.0, flush_at - loop.time())
+            elif idle is not None:
+                timeout = max(0.0, last_emit + idle - loop.time())
+            else:
+                timeout = None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if done:
+                task, pending = pending, None
+                try:
+                    piece = task.result()
+                except StopAsyncIteration:
+                    if buffer:
+                        yield buffer
+                    return
+                if not buffer:
+                    flush_at = loop.time() + window
+                buffer += piece
+                if len(buffer.encode("utf-8")) < max_bytes:
+                    continue
+            elif not buffer:
+                last_emit = loop.time()
+                yield ""
+                continue
+            yield buffer
+            buffer = ""
+            last_emit = loop.time()
+    finally:
+        if pending is not None:
+            pending.cancel()
+        elif hasattr(iterator, "aclose"):
+            await iterator.aclose()
+
+
+def sse_event(data: str, event_id: Optional[int] = None, event: Optional[str] = None) -> str:
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
+
+async def sse_stream(pieces: AsyncIterator[str], offset: int = 0, heartbeat: float = SSE_HEARTBEAT_INTERVAL) -> AsyncIterator[str]:
+    """
+    Texte coalescé en événements SSE. L'id d'un événement est le nombre de caractères
+    envoyés jusque-là : renvoyé dans Last-Event-ID, il sert d'offset de reprise.
+    Un événement `done` termine le flux, pour que le client ne se reconnecte pas.
+    """
+    async for chunk in coalesce(pieces, idle=heartbeat):
+        if not chunk:
+            yield ": heartbeat\n\n"
+            continue
+        offset += len(chunk)
+        yield sse_event(chunk, offset)
+    yield sse_event("", offset, event="done")
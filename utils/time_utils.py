@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def to_utc_datetime(value: Any) -> Optional[datetime]:
+    """
+    Normalize a stored timestamp to an aware UTC datetime.
+
+    Accepts native datetimes (naive ones are UTC, as stored by MongoDB) and the
+    legacy ISO strings: America/Toronto local time with offset for messages,
+    naive UTC `isoformat()` for analyses, optionally with a trailing "Z".
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        text = str(value).strip()
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        dt = datetime.fromisoformat(text)
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)